@@ -1,79 +1,424 @@
 import copy
+import io
+import struct
+import sys
+from array import array
+from collections import Counter
+from itertools import chain
 import xml.etree.ElementTree as et
-from xml.dom import minidom
+import numpy
 import pygame
+from framecache import FrameSurfaceCache
+from trim import detect_sprites
 
 FPS = 60
 
+# Binary animation files: a fixed header, the utf-8 spritesheet path padded
+# to 4 bytes, then little endian int32 columns -- frame rects (x, y, w, h),
+# frame durations, hitbox and damagebox offsets (n+1 each, frame i owns
+# boxes offsets[i]:offsets[i+1]) and the hitbox and damagebox rects.
+#
+# Version 2, written when some frames repeat a pose, has a pose count in
+# the header after the frame count. The rect and box columns then hold one
+# entry per pose, not per frame, followed by each frame's pose index and
+# then its duration.
+BINARY_EXT = '.banim'
+BINARY_MAGIC = b'BANM'
+BINARY_VERSION = 2
+_HEADER = struct.Struct('<4sHHIIII')
+_HEADER_V2 = struct.Struct('<4sHHIIIII')
+
+def pose_key(frame):
+        """What a frame shows, its rect and boxes but not its duration, as
+        one flat tuple: the rect, the hitbox count, then every box"""
+        return tuple(chain(frame.rect, (len(frame.hitboxes),),
+                           *frame.hitboxes, *frame.damageboxes))
+
 def save_animation(animation, sheetpath, outpath):
         if not animation:
                 raise Exception('Invalid Animation')
-        
-        anim = et.Element('animation')
-        anim.set('spritesheet', sheetpath)
+        out = io.StringIO()
+        write_animation_xml(animation, sheetpath, out)
+        return out.getvalue()
+
+def _escape(value):
+        """Escapes an attribute value the way minidom's writer does"""
+        return (value.replace('&', '&amp;').replace('<', '&lt;')
+                .replace('"', '&quot;').replace('>', '&gt;'))
+
+def _box_lines(group, tag, boxes):
+        if not boxes:
+                return '        <%s/>\n' % group
+        lines = ['        <%s>\n' % group]
+        for box in boxes:
+                lines.append('            <%s x="%s" y="%s" w="%s" h="%s"/>\n'
+                             % (tag, box.x, box.y, box.w, box.h))
+        lines.append('        </%s>\n' % group)
+        return ''.join(lines)
+
+def write_animation_xml(animation, sheetpath, out):
+        """Writes animation as XML to the text stream out one frame at a
+        time, without holding any tree.
+
+        A pose shown by more than one frame is written out in full once,
+        with an id, and the other frames only say <frame pose="id"
+        duration=".."/>. Animations that never repeat a pose come out byte
+        for byte as the pretty printed tree save_animation used to build."""
+        out.write('<?xml version="1.0" ?>\n')
+        head = '<animation spritesheet="%s"' % _escape(sheetpath)
+        if not animation.frames:
+                out.write(head + '/>\n')
+                return
+        out.write(head + '>\n')
+        # only hashes are kept for every frame; the keys themselves only
+        # for poses that look repeated
+        hashes = [hash(pose_key(frame)) for frame in animation.frames]
+        counts = Counter(hashes)
+        ids = {}
+        for frame, pose_hash in zip(animation.frames, hashes):
+                pose_id = ''
+                if counts[pose_hash] > 1:
+                        key = pose_key(frame)
+                        if key in ids:
+                                out.write('    <frame pose="%d" '
+                                          'duration="%s"/>\n'
+                                          % (ids[key], frame.duration))
+                                continue
+                        ids[key] = len(ids)
+                        pose_id = ' id="%d"' % ids[key]
+                rect = frame.rect
+                out.write('    <frame%s x="%s" y="%s" w="%s" h="%s" '
+                          'duration="%s">\n%s%s    </frame>\n'
+                          % (pose_id, rect.x, rect.y, rect.w, rect.h,
+                             frame.duration,
+                             _box_lines('hitboxes', 'hitbox', frame.hitboxes),
+                             _box_lines('damageboxes', 'damagebox',
+                                        frame.damageboxes)))
+        out.write('</animation>\n')
+
+def save_animation_file(animation, sheetpath, outpath):
+        """Streams animation straight into an XML file at outpath"""
+        if not animation:
+                raise Exception('Invalid Animation')
+        with open(outpath, 'w') as f:
+                write_animation_xml(animation, sheetpath, f)
+
+def _column(values):
+        col = array('i', values)
+        if sys.byteorder == 'big':
+                col.byteswap()
+        return col.tobytes()
+
+def save_animation_binary(animation, sheetpath, outpath):
+        """Same as save_animation but returns the compact binary format"""
+        if not animation:
+                raise Exception('Invalid Animation')
 
+        rects, durations, frame_poses = [], [], []
+        hit_offsets, dmg_offsets = [0], [0]
+        hitboxes, damageboxes = [], []
+        poses = {}
         for frame in animation.frames:
-                f = et.SubElement(anim, 'frame')
-                f.set('x', str(frame.rect.x))
-                f.set('y', str(frame.rect.y))
-                f.set('w', str(frame.rect.w))
-                f.set('h', str(frame.rect.h))
-                f.set('duration', str(frame.duration))
-                hitboxes = et.SubElement(f, 'hitboxes')
-                damageboxes = et.SubElement(f, 'damageboxes')
-                for hitbox in frame.hitboxes:
-                        h = et.SubElement(hitboxes, 'hitbox')
-                        h.set('x', str(hitbox.x))
-                        h.set('y', str(hitbox.y))
-                        h.set('w', str(hitbox.w))
-                        h.set('h', str(hitbox.h))
-                for dmgbox in frame.damageboxes:
-                        d = et.SubElement(damageboxes, 'damagebox')
-                        d.set('x', str(dmgbox.x))
-                        d.set('y', str(dmgbox.y))
-                        d.set('w', str(dmgbox.w))
-                        d.set('h', str(dmgbox.h))
+                durations.append(frame.duration)
+                key = pose_key(frame)
+                pose = poses.get(key)
+                if pose is None:
+                        pose = poses[key] = len(poses)
+                        # the key already holds the values, laid out flat
+                        split = 5 + 4*key[4]
+                        rects.extend(key[:4])
+                        hitboxes.extend(key[5:split])
+                        damageboxes.extend(key[split:])
+                        hit_offsets.append(len(hitboxes) // 4)
+                        dmg_offsets.append(len(damageboxes) // 4)
+                frame_poses.append(pose)
 
-        ugly = et.tostring(anim, 'utf-8')
-        parsed = minidom.parseString(ugly)
-        pretty = parsed.toprettyxml(indent="    ")
-        return pretty
+        path = sheetpath.encode('utf-8')
+        counts = (len(durations), len(hitboxes) // 4, len(damageboxes) // 4)
+        if len(poses) == len(durations):
+                # nothing repeats, keep to the version 1 layout
+                header = _HEADER.pack(BINARY_MAGIC, 1, 0, len(path), *counts)
+                columns = (rects, durations, hit_offsets, dmg_offsets,
+                           hitboxes, damageboxes)
+        else:
+                header = _HEADER_V2.pack(BINARY_MAGIC, 2, 0, len(path),
+                                         counts[0], len(poses), *counts[1:])
+                columns = (rects, hit_offsets, dmg_offsets, hitboxes,
+                           damageboxes, frame_poses, durations)
+        padding = b'\0' * (-len(path) % 4)
+        try:
+                columns = [_column(c) for c in columns]
+        except OverflowError:
+                raise Exception('Animation values must fit in 32 bits')
+        return b''.join([header, path, padding] + columns)
 
-def load_animation(filepath):
-        root = et.parse(filepath).getroot()
+def _rects(col):
+        return [pygame.Rect(col[i:i+4]) for i in range(0, len(col), 4)]
+
+def _check_offsets(offsets, count):
+        """Box offsets must run from 0 up to the number of boxes"""
+        steps = numpy.diff(numpy.frombuffer(offsets, dtype=numpy.int32))
+        if offsets[0] != 0 or offsets[-1] != count or (steps < 0).any():
+                raise ValueError('Animation box offsets are corrupt')
+
+def _unpack_animation(data, compact=False):
+        """Reads a binary animation out of a bytes-like object"""
+        data = memoryview(data)
+        if len(data) < _HEADER.size:
+                raise ValueError('Truncated animation header')
+        magic, version = struct.unpack_from('<4sH', data)
+        if magic != BINARY_MAGIC:
+                raise Exception('Not a binary animation')
+        if version > BINARY_VERSION:
+                raise Exception('Unsupported animation version %d' % version)
+        if version >= 2:
+                if len(data) < _HEADER_V2.size:
+                        raise ValueError('Truncated animation header')
+                (magic, version, flags, pathlen, nframes, nposes, nhits,
+                 ndmgs) = _HEADER_V2.unpack_from(data)
+                offset = _HEADER_V2.size
+                counts = (4*nposes, nposes+1, nposes+1, 4*nhits, 4*ndmgs,
+                          nframes, nframes)
+        else:
+                magic, version, flags, pathlen, nframes, nhits, ndmgs = \
+                        _HEADER.unpack_from(data)
+                offset = _HEADER.size
+                counts = (4*nframes, nframes, nframes+1, nframes+1,
+                          4*nhits, 4*ndmgs)
+        size = offset + pathlen + (-pathlen % 4) + 4*sum(counts)
+        if size > len(data):
+                raise ValueError('Animation is truncated: %d bytes where its '
+                                 'header needs %d' % (len(data), size))
+        spritesheet = str(data[offset:offset+pathlen], 'utf-8')
+        offset += pathlen + (-pathlen % 4)
+
+        columns = []
+        for count in counts:
+                col = array('i')
+                end = offset + count*col.itemsize
+                col.frombytes(data[offset:end])
+                if sys.byteorder == 'big':
+                        col.byteswap()
+                columns.append(col)
+                offset = end
+        if version >= 2:
+                _check_offsets(columns[1], nhits)
+                _check_offsets(columns[2], ndmgs)
+                frame_poses = numpy.frombuffer(columns[5], dtype=numpy.int32)
+                if len(frame_poses) and not (0 <= frame_poses.min() and
+                                             frame_poses.max() < nposes):
+                        raise ValueError('Animation frame refers to a '
+                                         'missing pose')
+                return (spritesheet, _unpack_poses(columns, compact))
+        rects, durations, hit_offsets, dmg_offsets, hits, dmgs = columns
+        _check_offsets(hit_offsets, nhits)
+        _check_offsets(dmg_offsets, ndmgs)
+        if compact:
+                # the columns are already in CompactAnimation's layout
+                animation = CompactAnimation(None)
+                animation._rects, animation._durations = rects, durations
+                animation._hit_offsets = hit_offsets
+                animation._dmg_offsets = dmg_offsets
+                animation._hitboxes, animation._damageboxes = hits, dmgs
+                return (spritesheet, animation)
+        hits, dmgs = _rects(hits), _rects(dmgs)
+
+        animation = Animation(None)
+        for i, rect in enumerate(_rects(rects)):
+                frame = AnimFrame(rect)
+                frame.duration = durations[i]
+                frame.hitboxes = hits[hit_offsets[i]:hit_offsets[i+1]]
+                frame.damageboxes = dmgs[dmg_offsets[i]:dmg_offsets[i+1]]
+                animation.frames.append(frame)
+        return (spritesheet, animation)
+
+def _pose_frames(rects, hit_offsets, dmg_offsets, hits, dmgs):
+        poses = []
+        hits, dmgs = _rects(hits), _rects(dmgs)
+        for i, rect in enumerate(_rects(rects)):
+                pose = AnimFrame(rect)
+                pose.hitboxes = hits[hit_offsets[i]:hit_offsets[i+1]]
+                pose.damageboxes = dmgs[dmg_offsets[i]:dmg_offsets[i+1]]
+                poses.append(pose)
+        return poses
+
+def _expand_boxes(boxes, offsets, frame_poses):
+        """Per frame (boxes, offsets) columns from per pose ones"""
+        offsets = numpy.frombuffer(offsets, dtype=numpy.int32)
+        counts = (offsets[1:] - offsets[:-1])[frame_poses]
+        ends = numpy.cumsum(counts)
+        starts = ends - counts
+        # the i'th box of a frame is box starts[pose] + i of its pose
+        firsts = numpy.repeat(offsets[:-1][frame_poses] - starts, counts)
+        picks = firsts + numpy.arange(int(ends[-1]) if len(ends) else 0)
+        boxes = numpy.frombuffer(boxes, dtype=numpy.int32).reshape(-1, 4)
+        new_offsets = numpy.concatenate(([0], ends)).astype(numpy.int32)
+        return (array('i', boxes[picks].tobytes()),
+                array('i', new_offsets.tobytes()))
+
+def _unpack_poses(columns, compact):
+        """An animation out of version 2 pose table columns"""
+        (rects, hit_offsets, dmg_offsets, hits, dmgs, frame_poses,
+         durations) = columns
+        if compact:
+                # CompactAnimation keeps every frame's values, so the poses
+                # are spread back out over the frames
+                index = numpy.frombuffer(frame_poses, dtype=numpy.int32)
+                animation = CompactAnimation(None)
+                pose_rects = numpy.frombuffer(rects, dtype=numpy.int32)
+                animation._rects = array(
+                        'i', pose_rects.reshape(-1, 4)[index].tobytes())
+                animation._durations = durations
+                animation._hitboxes, animation._hit_offsets = \
+                        _expand_boxes(hits, hit_offsets, index)
+                animation._damageboxes, animation._dmg_offsets = \
+                        _expand_boxes(dmgs, dmg_offsets, index)
+                return animation
+        poses = _pose_frames(rects, hit_offsets, dmg_offsets, hits, dmgs)
+        animation = Animation(None)
+        animation.frames = [poses[pose].share(duration)
+                            for pose, duration in zip(frame_poses, durations)]
+        for pose in poses:
+                animation.poses[pose_key(pose)] = pose
+        return animation
+
+def load_animation_binary(filepath, compact=False):
+        """Same as load_animation for the compact binary format. With
+        compact the columns are loaded straight into a CompactAnimation."""
+        if hasattr(filepath, 'read'):
+                return _unpack_animation(filepath.read(), compact)
+        with open(filepath, 'rb') as f:
+                return _unpack_animation(f.read(), compact)
+
+def open_animation(filepath, compact=False):
+        """Loads an animation file in either format"""
+        with open(filepath, 'rb') as f:
+                data = f.read()
+        if data[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+                return _unpack_animation(data, compact)
+        spritesheet, animation = load_animation(filepath)
+        if compact:
+                animation = CompactAnimation.from_animation(animation)
+        return (spritesheet, animation)
+
+def _xml_frame(frame):
+        attrs = frame.attrib
+        rect = (int(frame.attrib[x]) for x in 'xywh')
+        x,y,w,h = rect
+        anim_frame = AnimFrame(pygame.Rect(x,y,w,h))
+        anim_frame.duration = int(attrs['duration'])
+        for child in frame:
+                if len(child) > 0:
+                        for box in child:
+                                box_rect = (int(box.attrib[x]) for x in 'xywh')
+                                x,y,w,h = box_rect
+                                if box.tag == 'hitbox':
+                                        anim_frame.add_hitbox(pygame.Rect(x,y,w,h))
+                                elif box.tag == 'damagebox':
+                                        anim_frame.add_damagebox(pygame.Rect(x,y,w,h))
+        return anim_frame
+
+def iter_animation_xml(filepath):
+        """Returns (spritesheet, frames) where frames is an iterator that
+        parses one AnimFrame at a time. Elements are dropped as soon as
+        their frame is built, so parsing takes the same memory whatever
+        the frame count, or rather the number of distinct poses."""
+        events = et.iterparse(filepath, events=('start', 'end'))
+        event, root = next(events)
         spritesheet = root.attrib['spritesheet']
+
+        def frames():
+                # frames with an id, which later frames can show again
+                poses = {}
+                depth = 1
+                for event, elem in events:
+                        if event == 'start':
+                                depth += 1
+                                continue
+                        depth -= 1
+                        if depth != 1:
+                                continue
+                        pose = elem.attrib.get('pose')
+                        if pose is not None:
+                                if pose not in poses:
+                                        raise ValueError('frame refers to '
+                                                         'undefined pose %r'
+                                                         % pose)
+                                frame = poses[pose].share(
+                                        int(elem.attrib['duration']))
+                        else:
+                                frame = _xml_frame(elem)
+                                if 'id' in elem.attrib:
+                                        poses[elem.attrib['id']] = frame
+                        # forget the finished frame and its children
+                        root.clear()
+                        yield frame
+        return (spritesheet, frames())
+
+def load_animation(filepath):
+        spritesheet, frames = iter_animation_xml(filepath)
         animation = Animation(None)
-        for frame in root:
-                attrs = frame.attrib
-                rect = (int(frame.attrib[x]) for x in 'xywh')
-                x,y,w,h = rect
-                anim_frame = AnimFrame(pygame.Rect(x,y,w,h))
-                anim_frame.duration = int(attrs['duration'])
-                for child in frame:
-                        if len(child) > 0:
-                                for box in child:
-                                        box_rect = (int(box.attrib[x]) for x in 'xywh')
-                                        x,y,w,h = box_rect
-                                        if box.tag == 'hitbox':
-                                                anim_frame.add_hitbox(pygame.Rect(x,y,w,h))
-                                        elif box.tag == 'damagebox':
-                                                anim_frame.add_damagebox(pygame.Rect(x,y,w,h))
-                animation.add_frame(anim_frame)
+        # the frames are fresh, no need for add_frame's copies
+        animation.frames.extend(frames)
+        animation.invalidate()
         return (spritesheet, animation)
 
+def detect_frames(sheet, duration=1, background=None):
+        """Slices a whole spritesheet into AnimFrames, one per sprite, in
+        reading order. Doesn't need a display."""
+        frames = []
+        for rect in detect_sprites(sheet, background=background):
+                frame = AnimFrame(rect)
+                frame.duration = duration
+                frames.append(frame)
+        return frames
+
 class Animation:
+        # Animations up to this many ticks long get a direct tick -> frame
+        # table, longer ones are looked up by bisecting the frame end ticks
+        TABLE_LIMIT = 1 << 16
+
         def __init__(self, sheet):
                 self.sheet = sheet
+                self.surfaces = None
+                self.invalidate()
+                # pose_key -> the frame whose rect and boxes added frames
+                # with that pose share
+                self.poses = {}
                 self.frames = []
                 self.playing = False
                 self.current_frame = 0
                 self.current_tick = 0
+                self.tick_fraction = 0.0
+
+        def intern(self, frame):
+                """A new frame with frame's duration that shares its rect and
+                boxes with any earlier frame of the same pose"""
+                key = pose_key(frame)
+                pose = self.poses.get(key)
+                if pose is None:
+                        pose = self.poses[key] = copy.deepcopy(frame)
+                return pose.share(frame.duration)
+
+        def intern_frames(self):
+                """Makes every frame share with the others of its pose, for
+                animations whose frames were put in some other way. Returns
+                the number of distinct poses."""
+                self.poses = {}
+                self.frames = [self.intern(frame) for frame in self.frames]
+                return len(self.poses)
 
         def add_frame(self, frame):
-                self.frames.append(copy.deepcopy(frame))
+                self.frames.append(self.intern(frame))
+                self.invalidate()
+
+        def insert_frame(self, index, frame):
+                self.frames.insert(index, self.intern(frame))
+                self.invalidate()
 
         def remove_frame(self, index):
                 self.frames.pop(index)
+                self.invalidate()
                 index -= 1
                 if self.frames:
                         if index < 0:
@@ -99,10 +444,33 @@ class Animation:
                 self.current_tick += 1
 
 
+        def cache_surfaces(self, enabled=True):
+                """Makes draw blit pre-cut frame surfaces instead of areas of
+                the whole sheet"""
+                self.surfaces = FrameSurfaceCache(self.sheet) if enabled else None
+
+        def frame_surface(self, frame, flip_x=False, flip_y=False, scale=1):
+                """Returns (surface, offset) for frame from the surface cache,
+                which is started over if the sheet has been replaced"""
+                if self.surfaces is None or self.surfaces.sheet is not self.sheet:
+                        self.surfaces = FrameSurfaceCache(self.sheet)
+                elif len(self.surfaces) > 2 * len(self.frames) + 16:
+                        self.surfaces.prune(f.rect for f in self.frames)
+                return self.surfaces.get(frame.rect, flip_x, flip_y, scale)
+
         def draw(self, screen, x, y):
                 if len(self.frames) > 0 and self.sheet:
                         frame = self.frames[self.current_frame]
-                        screen.blit(self.sheet, (x, y), frame.rect)
+                        # sheets that aren't Surfaces, like TiledSheet, are
+                        # always drawn through the surface cache
+                        if self.surfaces is None and \
+                                        isinstance(self.sheet, pygame.Surface):
+                                screen.blit(self.sheet, (x, y), frame.rect)
+                                return
+                        entry = self.frame_surface(frame)
+                        if entry:
+                                image, (dx, dy) = entry
+                                screen.blit(image, (x + dx, y + dy))
 
         def is_complete(self):
                 return self.current_frame > len(self.frames)-2
@@ -110,20 +478,263 @@ class Animation:
         def restart(self):
                 self.current_tick = 0
                 self.current_frame = 0
-                
+                self.tick_fraction = 0.0
+
+        def durations(self):
+                """Returns every frame's duration in ticks, in order"""
+                return [frame.duration for frame in self.frames]
+
+        def invalidate(self):
+                """Forgets the cached timeline. Frames added or removed through
+                the Animation do this themselves; call it after changing a
+                frame's duration in place."""
+                self._starts = None
+                self._ends = None
+                self._table = None
+
+        def timeline(self):
+                """Returns (starts, ends), the first tick of each frame and the
+                tick just past it, building them if needed"""
+                if self._ends is None:
+                        durations = numpy.asarray(self.durations(),
+                                                  dtype=numpy.int64)
+                        durations = numpy.maximum(durations, 0)
+                        self._ends = numpy.cumsum(durations)
+                        self._starts = self._ends - durations
+                        total = int(self._ends[-1]) if len(durations) else 0
+                        if total <= self.TABLE_LIMIT:
+                                self._table = numpy.repeat(
+                                        numpy.arange(len(durations)), durations)
+                return (self._starts, self._ends)
+
+        def total_ticks(self):
+                starts, ends = self.timeline()
+                return int(ends[-1]) if len(ends) else 0
+
+        def _wrap(self, tick, loop):
+                total = self.total_ticks()
+                tick = int(tick)
+                if loop:
+                        return tick % total
+                return min(max(tick, 0), total - 1)
+
+        def frame_at(self, tick, loop=True):
+                """Returns the index of the frame showing at tick, or None if
+                nothing is ever shown. Ticks past the end wrap around when
+                loop is set and stay on the last frame otherwise."""
+                starts, ends = self.timeline()
+                if self.total_ticks() == 0:
+                        return None
+                tick = self._wrap(tick, loop)
+                if self._table is not None:
+                        return int(self._table[tick])
+                return int(numpy.searchsorted(ends, tick, side='right'))
+
+        def position(self):
+                """Returns how many ticks into the animation playback is"""
+                starts, ends = self.timeline()
+                if self.current_frame >= len(starts):
+                        return 0
+                return int(starts[self.current_frame]) + self.current_tick
+
+        def seek(self, tick, loop=True):
+                """Jumps playback straight to tick"""
+                index = self.frame_at(tick, loop)
+                if index is None:
+                        return
+                starts, ends = self.timeline()
+                self.current_frame = index
+                self.current_tick = self._wrap(tick, loop) - int(starts[index])
+
+        def advance(self, seconds, loop=True):
+                """Moves playback on by a span of real time, whatever rate it
+                is called at. Returns False once an animation that doesn't
+                loop has played to its end."""
+                total = self.total_ticks()
+                if total == 0:
+                        return False
+                ticks = self.tick_fraction + seconds * FPS
+                whole = int(ticks)
+                self.tick_fraction = ticks - whole
+                target = self.position() + whole
+                if not loop and target >= total:
+                        self.seek(total - 1, loop)
+                        return False
+                if whole:
+                        self.seek(target, loop)
+                return True
+
+
+class AnimationPlayer:
+        """Plays many instances of one Animation at once.
+
+        The Animation is shared and treated as read only. Each instance is
+        just a slot in a handful of numpy arrays (position, playback tick,
+        playing and loop flags), so step() moves every instance on in one
+        vectorized update and draw() hands all of them to Surface.blits.
+        Call reload() if the animation's frames do change.
+        """
+        def __init__(self, animation, capacity=64):
+                self.animation = animation
+                self.positions = numpy.zeros((capacity, 2), dtype=numpy.int32)
+                self.ticks = numpy.zeros(capacity, dtype=numpy.float64)
+                self.playing = numpy.zeros(capacity, dtype=bool)
+                self.looping = numpy.zeros(capacity, dtype=bool)
+                self.alive = numpy.zeros(capacity, dtype=bool)
+                self.free = list(range(capacity-1, -1, -1))
+                self.reload()
+
+        def reload(self):
+                """Re-reads the animation's frame rects and timeline"""
+                self.areas = [tuple(frame.rect) for frame in self.animation.frames]
+                self.total = self.animation.total_ticks()
+
+        def _grow(self):
+                size = len(self.alive)
+                extra = max(size, 1)
+                self.positions = numpy.concatenate(
+                        (self.positions, numpy.zeros((extra, 2), numpy.int32)))
+                self.ticks = numpy.concatenate((self.ticks, numpy.zeros(extra)))
+                for name in ('playing', 'looping', 'alive'):
+                        flags = numpy.zeros(extra, dtype=bool)
+                        setattr(self, name,
+                                numpy.concatenate((getattr(self, name), flags)))
+                self.free.extend(range(size+extra-1, size-1, -1))
+
+        def add(self, x, y, loop=True, tick=0):
+                """Starts a new playing instance at (x, y), returns its id"""
+                if not self.free:
+                        self._grow()
+                i = self.free.pop()
+                self.positions[i] = (x, y)
+                self.ticks[i] = tick
+                self.playing[i] = True
+                self.looping[i] = loop
+                self.alive[i] = True
+                return i
+
+        def remove(self, i):
+                if not self.alive[i]:
+                        return
+                self.alive[i] = False
+                self.playing[i] = False
+                self.free.append(i)
+
+        def move(self, i, x, y):
+                self.positions[i] = (x, y)
+
+        def play(self, i):
+                self.playing[i] = True
+
+        def pause(self, i):
+                self.playing[i] = False
+
+        def restart(self, i):
+                self.ticks[i] = 0
+                self.playing[i] = True
+
+        def __len__(self):
+                return int(numpy.count_nonzero(self.alive))
+
+        def step(self, ticks=1):
+                """Advances every playing instance by ticks, which may be
+                fractional. Instances that don't loop stop on their last
+                frame."""
+                if self.total == 0:
+                        return
+                self.ticks[self.playing] += ticks
+                looped = self.playing & self.looping
+                self.ticks[looped] %= self.total
+                ended = self.playing & ~self.looping & (self.ticks >= self.total)
+                self.ticks[ended] = self.total - 1
+                self.playing[ended] = False
+
+        def advance(self, seconds):
+                """Same as step, for a span of real time"""
+                self.step(seconds * FPS)
+
+        def frames(self):
+                """Returns (ids, frame indices) of every live instance"""
+                ids = numpy.flatnonzero(self.alive)
+                if self.total == 0:
+                        # nothing to step through, hold the first frame
+                        return ids, numpy.zeros(len(ids), dtype=numpy.intp)
+                starts, ends = self.animation.timeline()
+                ticks = numpy.floor(self.ticks[ids])
+                # ticks left over from before a reload may run past the end
+                return ids, numpy.minimum(
+                        numpy.searchsorted(ends, ticks, side='right'),
+                        len(ends) - 1)
+
+        def draw(self, screen, offset=(0, 0)):
+                """Blits every live instance in one Surface.blits call"""
+                sheet = self.animation.sheet
+                if not sheet or not self.areas:
+                        return
+                ids, frames = self.frames()
+                positions = (self.positions[ids] + offset).tolist()
+                areas = self.areas
+                screen.blits([(sheet, pos, areas[f])
+                              for pos, f in zip(positions, frames.tolist())],
+                             doreturn=False)
 
 class AnimFrame:
+        """One frame: a rect on the sheet, its boxes and a duration.
+
+        Frames holding the same pose may share their rect and box lists
+        (see Animation.intern), so the add, remove and set methods below
+        copy a list before changing it, and a rect or box is replaced
+        rather than changed in place.
+        """
+        __slots__ = ('rect', 'hitboxes', 'damageboxes', 'duration')
+
         def __init__(self, rect):
                 self.rect = rect
                 self.hitboxes = []
                 self.damageboxes = []
                 self.duration = 1
 
+        def share(self, duration):
+                """A frame of duration showing this frame's pose, sharing
+                its rect and box lists"""
+                frame = AnimFrame(self.rect)
+                frame.hitboxes = self.hitboxes
+                frame.damageboxes = self.damageboxes
+                frame.duration = duration
+                return frame
+
         def add_hitbox(self, rect):
-                self.hitboxes.append(copy.deepcopy(rect))
+                self.hitboxes = self.hitboxes + [copy.deepcopy(rect)]
 
         def add_damagebox(self, rect):
-                self.damageboxes.append(copy.deepcopy(rect))
+                self.damageboxes = self.damageboxes + [copy.deepcopy(rect)]
+
+        def remove_hitbox(self, index=-1):
+                boxes = list(self.hitboxes)
+                old = boxes.pop(index)
+                self.hitboxes = boxes
+                return old
+
+        def remove_damagebox(self, index=-1):
+                boxes = list(self.damageboxes)
+                old = boxes.pop(index)
+                self.damageboxes = boxes
+                return old
+
+        def set_hitbox(self, index, rect):
+                """Replaces a hitbox, returning the old one"""
+                boxes = list(self.hitboxes)
+                old = boxes[index]
+                boxes[index] = copy.deepcopy(rect)
+                self.hitboxes = boxes
+                return old
+
+        def set_damagebox(self, index, rect):
+                boxes = list(self.damageboxes)
+                old = boxes[index]
+                boxes[index] = copy.deepcopy(rect)
+                self.damageboxes = boxes
+                return old
 
         def __str__(self):
                 return "[%d, %d, %d, %d]" % (self.rect.x, self.rect.y,
@@ -131,3 +742,264 @@ class AnimFrame:
         def __repr__(self):
                 return "[%d, %d, %d, %d]" % (self.rect.x, self.rect.y,
                                              self.rect.w, self.rect.h)
+
+
+def _shift(col, start, delta):
+        """Adds delta to every entry of an int32 column from start on"""
+        numpy.frombuffer(col, dtype=numpy.int32)[start:] += delta
+
+class CompactAnimation(Animation):
+        """Animation that keeps its frames in flat int32 columns instead of
+        AnimFrame objects.
+
+        Frame rects and durations get one column each. Hitboxes and
+        damageboxes live in one table per kind, with an offsets column
+        saying which run of boxes belongs to which frame. frames hands out
+        FrameViews, which read and write the columns, so code written
+        against AnimFrame keeps working.
+        """
+        def __init__(self, sheet):
+                self._clear()
+                super().__init__(sheet)
+
+        def _clear(self):
+                self._rects = array('i')
+                self._durations = array('i')
+                self._hit_offsets = array('i', [0])
+                self._dmg_offsets = array('i', [0])
+                self._hitboxes = array('i')
+                self._damageboxes = array('i')
+
+        @classmethod
+        def from_animation(cls, animation):
+                compact = cls(animation.sheet)
+                compact.frames = animation.frames
+                return compact
+
+        @property
+        def frames(self):
+                return _FrameList(self)
+
+        @frames.setter
+        def frames(self, frames):
+                frames = list(frames)
+                self._clear()
+                for frame in frames:
+                        self.add_frame(frame)
+                self.invalidate()
+
+        def add_frame(self, frame):
+                """Appends a copy of frame's values, no deepcopy needed"""
+                self._rects.extend(frame.rect)
+                self._durations.append(frame.duration)
+                for hitbox in frame.hitboxes:
+                        self._hitboxes.extend(hitbox)
+                for dmgbox in frame.damageboxes:
+                        self._damageboxes.extend(dmgbox)
+                self._hit_offsets.append(len(self._hitboxes) // 4)
+                self._dmg_offsets.append(len(self._damageboxes) // 4)
+                self.invalidate()
+
+        def insert_frame(self, index, frame):
+                count = len(self._durations)
+                if index < 0:
+                        index += count
+                index = min(max(index, 0), count)
+                self._rects[4*index:4*index] = array('i', frame.rect)
+                self._durations.insert(index, frame.duration)
+                for boxes, offsets, new in (
+                                (self._hitboxes, self._hit_offsets,
+                                 frame.hitboxes),
+                                (self._damageboxes, self._dmg_offsets,
+                                 frame.damageboxes)):
+                        at = offsets[index]
+                        flat = array('i')
+                        for box in new:
+                                flat.extend(box)
+                        boxes[4*at:4*at] = flat
+                        offsets.insert(index+1, at)
+                        _shift(offsets, index+1, len(new))
+                self.invalidate()
+
+        def remove_frame(self, index):
+                if index < 0:
+                        index += len(self._durations)
+                del self._rects[4*index:4*index+4]
+                del self._durations[index]
+                for boxes, offsets in ((self._hitboxes, self._hit_offsets),
+                                       (self._damageboxes, self._dmg_offsets)):
+                        start, end = offsets[index], offsets[index+1]
+                        del boxes[4*start:4*end]
+                        del offsets[index+1]
+                        _shift(offsets, index+1, start - end)
+                self.invalidate()
+                index -= 1
+                if self._durations:
+                        return self.frames[max(index, 0)]
+                return None
+
+        def durations(self):
+                return self._durations
+
+        def _get_boxes(self, boxes, offsets, index):
+                start, end = offsets[index], offsets[index+1]
+                return _rects(boxes[4*start:4*end])
+
+        def _add_box(self, boxes, offsets, index, rect):
+                end = 4*offsets[index+1]
+                boxes[end:end] = array('i', rect)
+                _shift(offsets, index+1, 1)
+
+        def _remove_box(self, boxes, offsets, index, box):
+                start, end = offsets[index], offsets[index+1]
+                if box < 0:
+                        box += end - start
+                if not 0 <= box < end - start:
+                        raise IndexError('box index out of range')
+                at = 4*(start + box)
+                rect = pygame.Rect(boxes[at:at+4].tolist())
+                del boxes[at:at+4]
+                _shift(offsets, index+1, -1)
+                return rect
+
+        def _replace_boxes(self, boxes, offsets, index, rects):
+                """Swaps frame index's whole run of boxes for rects"""
+                start, end = offsets[index], offsets[index+1]
+                flat = array('i')
+                for rect in rects:
+                        flat.extend(pygame.Rect(rect))
+                boxes[4*start:4*end] = flat
+                _shift(offsets, index+1, len(flat) // 4 - (end - start))
+
+        def _set_box(self, boxes, offsets, index, box, rect):
+                start, end = offsets[index], offsets[index+1]
+                if box < 0:
+                        box += end - start
+                if not 0 <= box < end - start:
+                        raise IndexError('box index out of range')
+                at = 4*(start + box)
+                old = pygame.Rect(boxes[at:at+4].tolist())
+                boxes[at:at+4] = array('i', rect)
+                return old
+
+class _FrameList:
+        """Sequence of FrameViews over a CompactAnimation"""
+        def __init__(self, animation):
+                self.animation = animation
+
+        def __len__(self):
+                return len(self.animation._durations)
+
+        def __getitem__(self, index):
+                if isinstance(index, slice):
+                        return [FrameView(self.animation, i)
+                                for i in range(*index.indices(len(self)))]
+                if index < 0:
+                        index += len(self)
+                if not 0 <= index < len(self):
+                        raise IndexError('frame index out of range')
+                return FrameView(self.animation, index)
+
+        def __iter__(self):
+                for i in range(len(self)):
+                        yield FrameView(self.animation, i)
+
+class FrameView:
+        """AnimFrame-like view of frame index in a CompactAnimation.
+
+        rect and the box lists are handed out as fresh Rects, so change a
+        frame through its attributes and add_* methods rather than by
+        mutating what they return. Views of later frames shift along when
+        a frame is removed, so fetch them again afterwards.
+        """
+        def __init__(self, animation, index):
+                self.animation = animation
+                self.index = index
+
+        @property
+        def rect(self):
+                i = 4*self.index
+                return pygame.Rect(self.animation._rects[i:i+4])
+
+        @rect.setter
+        def rect(self, rect):
+                i = 4*self.index
+                self.animation._rects[i:i+4] = array('i', rect)
+
+        @property
+        def duration(self):
+                return self.animation._durations[self.index]
+
+        @duration.setter
+        def duration(self, duration):
+                self.animation._durations[self.index] = duration
+                self.animation.invalidate()
+
+        @property
+        def hitboxes(self):
+                anim = self.animation
+                return anim._get_boxes(anim._hitboxes, anim._hit_offsets,
+                                       self.index)
+
+        @hitboxes.setter
+        def hitboxes(self, rects):
+                anim = self.animation
+                anim._replace_boxes(anim._hitboxes, anim._hit_offsets,
+                                    self.index, rects)
+
+        @property
+        def damageboxes(self):
+                anim = self.animation
+                return anim._get_boxes(anim._damageboxes, anim._dmg_offsets,
+                                       self.index)
+
+        @damageboxes.setter
+        def damageboxes(self, rects):
+                anim = self.animation
+                anim._replace_boxes(anim._damageboxes, anim._dmg_offsets,
+                                    self.index, rects)
+
+        def add_hitbox(self, rect):
+                anim = self.animation
+                anim._add_box(anim._hitboxes, anim._hit_offsets, self.index,
+                              rect)
+
+        def add_damagebox(self, rect):
+                anim = self.animation
+                anim._add_box(anim._damageboxes, anim._dmg_offsets,
+                              self.index, rect)
+
+        def remove_hitbox(self, index=-1):
+                anim = self.animation
+                return anim._remove_box(anim._hitboxes, anim._hit_offsets,
+                                        self.index, index)
+
+        def remove_damagebox(self, index=-1):
+                anim = self.animation
+                return anim._remove_box(anim._damageboxes, anim._dmg_offsets,
+                                        self.index, index)
+
+        def set_hitbox(self, index, rect):
+                anim = self.animation
+                return anim._set_box(anim._hitboxes, anim._hit_offsets,
+                                     self.index, index, rect)
+
+        def set_damagebox(self, index, rect):
+                anim = self.animation
+                return anim._set_box(anim._damageboxes, anim._dmg_offsets,
+                                     self.index, index, rect)
+
+        def share(self, duration):
+                """A standalone AnimFrame of duration holding a copy of this
+                frame's pose"""
+                frame = AnimFrame(self.rect)
+                frame.hitboxes = self.hitboxes
+                frame.damageboxes = self.damageboxes
+                frame.duration = duration
+                return frame
+
+        def __str__(self):
+                return "[%d, %d, %d, %d]" % tuple(self.rect)
+
+        def __repr__(self):
+                return "[%d, %d, %d, %d]" % tuple(self.rect)
@@ -1,14 +1,22 @@
 from tkinter import *
 from tkinter import ttk
-from tkinter.filedialog import askopenfile, asksaveasfile
+from tkinter import messagebox
+from tkinter import simpledialog
+from tkinter.filedialog import askopenfilename, asksaveasfilename
 import pygame
 import os
 import copy
+import time
 import animation
+import history
 from animation import Animation, AnimFrame
 from subview import SpritesheetSubView, FrameSubView, AnimationSubView
-
-FPS = 60
+from tiledsheet import TiledSheetCache
+from profiler import Profiler
+from project import Project, PROJECT_EXT
+from loader import Loader, decode_sheet, read_animation
+from journal import EditJournal, frame_record, journal_path, \
+        orphaned_journals, discard_journal, recover
 
 class View:
         def __init__(self, frame, width, height):
@@ -22,6 +30,7 @@ class View:
                 self.font = pygame.font.SysFont('arial', 16)
                 self.width, self.height = (width, height)
                 self.screen = pygame.display.set_mode((self.width,self.height))
+                self.profiler = Profiler()
                 
                 sheet_view = (0, 0, self.width, self.height/2)
                 frame_view = (0, self.height/2, self.width/2, self.height/2)
@@ -34,37 +43,129 @@ class View:
                 self.subviews = [self.sheet_view, self.frame_view,
                                  self.anim_view]
                 self.sheetpath = ""
-                
-                self.clock = pygame.time.Clock()
+                self.detail_index = None
+                self.journal = None
+                self.history = history.History()
+                # edits made since the animation was shown or saved
+                self.modified = False
                 
                 pygame.display.update()
 
         def mainloop(self, app):
-                for event in pygame.event.get():
-                        if event.type == pygame.KEYDOWN:
-                                if event.key == pygame.K_DOWN:
-                                        app.down_key()
-                                elif event.key == pygame.K_UP:
-                                        app.up_key()
-                        for view in self.subviews:
-                                view.handle_event(event)
+                """Handles pending input and redraws what changed. Returns
+                True if there was any input."""
+                profiler = self.profiler
+                started = time.perf_counter()
+                with profiler.phase('events'):
+                        events = pygame.event.get()
+                        for event in events:
+                                if event.type == pygame.QUIT:
+                                        app.quit()
+                                        return False
+                                if event.type == pygame.KEYDOWN:
+                                        self.handle_key(event, app)
+                                elif event.type == pygame.VIDEOEXPOSE:
+                                        self.invalidate()
+                                for view in self.subviews:
+                                        with profiler.phase('handle ' +
+                                                            view.name):
+                                                view.handle_event(event)
 
                 for view in self.subviews:
-                        view.tick()
+                        with profiler.phase('tick ' + view.name):
+                                view.tick()
+                self.take_edits(app)
 
-                self.screen.fill(pygame.Color(0, 0, 0))
+                # Only redraw and push the parts of the screen that changed
+                dirty = []
+                for view in self.subviews:
+                        rect = view.take_dirty()
+                        if rect:
+                                with profiler.phase('draw ' + view.name):
+                                        self.screen.set_clip(rect)
+                                        self.screen.fill(pygame.Color(0, 0, 0))
+                                        view.draw(self.screen)
+                                dirty.append(rect)
+                self.screen.set_clip(None)
+                if profiler.overlay:
+                        with profiler.phase('overlay'):
+                                dirty.append(profiler.draw_overlay(self.screen,
+                                                                   self.font))
+                if dirty:
+                        with profiler.phase('update'):
+                                pygame.display.update(dirty)
+                profiler.record('frame', started, time.perf_counter())
+                return len(events) > 0
+
+        def handle_key(self, event, app):
+                if event.key == pygame.K_DOWN:
+                        app.down_key()
+                elif event.key == pygame.K_UP:
+                        app.up_key()
+                elif event.key == pygame.K_F3:
+                        self.profiler.overlay = not self.profiler.overlay
+                        self.invalidate()
+                elif event.key == pygame.K_F4:
+                        app.show_status('Trace written to %s'
+                                        % self.profiler.dump_trace())
+                elif event.mod & pygame.KMOD_CTRL:
+                        if event.key == pygame.K_z:
+                                app.undo()
+                        elif event.key == pygame.K_y:
+                                app.redo()
+
+        def take_edits(self, app):
+                """Applies box drags and frame picks made with the mouse, on the
+                sheet or in the filmstrip"""
+                edit = self.frame_view.take_box_edit()
+                if edit and self.detail_index is not None:
+                        kind, box, old, new = edit
+                        self.execute(history.SetBox(self.detail_index, kind,
+                                                    box, old, new))
+                picked = self.sheet_view.take_picked()
+                if picked is None:
+                        picked = self.anim_view.take_picked()
+                if picked is not None:
+                        app.select_frame(picked)
+
+        def is_busy(self):
+                """True while something on screen moves without input"""
+                if self.anim_view.is_playing:
+                        return True
+                return any(view.is_dragging() for view in self.subviews)
+
+        def invalidate(self):
                 for view in self.subviews:
-                        view.draw(self.screen)
-                pygame.display.flip()
-                self.clock.tick(FPS)
+                        view.invalidate()
 
         def set_spritesheet(self, sheet):
                 for view in self.subviews:
                         view.spritesheet = sheet
+                        view.invalidate()
+                self.frame_view.clear_surfaces()
+
+        def set_sheetpath(self, path):
+                self.sheetpath = path
+                self.record('sheet', path=path)
+
+        def record(self, op, **fields):
+                """Logs an edit to the journal, if there is one"""
+                self.modified = True
+                if self.journal:
+                        self.journal.record(op, **fields)
 
         def set_detail_frame(self, index):
-                frame = self.anim_view.animation.frames[index]
-                self.frame_view.set_frame(frame)
+                anim = self.anim_view.animation
+                self.frame_view.set_frame(anim.frames[index], anim, index)
+                self.detail_index = index
+                self.anim_view.selected = index
+                self.anim_view.invalidate()
+
+        def set_onion(self, count):
+                self.frame_view.set_onion(count)
+
+        def set_filmstrip(self, enabled):
+                self.anim_view.set_filmstrip(enabled)
         
         def add_frame(self, duration):
                 sheetclip = self.sheet_view.get_clip()
@@ -72,43 +173,149 @@ class View:
                         return None
                 frame = AnimFrame(sheetclip)
                 frame.duration = duration
-                self.anim_view.add_frame(frame)
-                self.frame_view.set_frame(frame)
-                return len(self.anim_view.animation.frames)
+                count = self.frame_count()
+                self.execute(history.InsertFrame(count, frame))
+                return count + 1
+
+        def detect_frames(self, duration):
+                sheet = self.sheet_view.spritesheet
+                if not sheet:
+                        return 0
+                frames = animation.detect_frames(sheet, duration)
+                count = self.frame_count()
+                if frames:
+                        self.execute(history.Batch(
+                                history.InsertFrame(count + i, frame)
+                                for i, frame in enumerate(frames)))
+                return len(frames)
 
         def remove_frame(self, index):
+                self.execute(history.RemoveFrame(index))
+
+        def add_hitbox(self):
+                self.add_box('hitbox')
+
+        def add_damagebox(self):
+                self.add_box('damagebox')
+
+        def add_box(self, kind):
+                rect = self.frame_view.new_box()
+                if rect and self.detail_index is not None:
+                        self.execute(history.AddBox(self.detail_index, kind,
+                                                    rect))
+
+        def frame_count(self):
+                if not self.anim_view.animation:
+                        return 0
+                return len(self.anim_view.animation.frames)
+
+        def execute(self, command):
+                """Applies an edit and makes it undoable"""
+                command.do(self)
+                self.history.push(command)
+
+        def undo(self):
+                """Returns True if there was anything to undo"""
+                return self.history.undo(self) is not None
+
+        def redo(self):
+                return self.history.redo(self) is not None
+
+        # Edit primitives. Everything that changes the animation goes
+        # through these so the journal and the screen stay in step.
+
+        def insert_frame_at(self, index, frame):
+                self.anim_view.insert_frame(index, frame)
+                self.sheet_view.frame_inserted(self.anim_view.animation.frames,
+                                               index)
+                self.record('insert_frame', index=index,
+                            frame=frame_record(frame))
+                # show the animation's own copy so box edits land in it
+                self.set_detail_frame(index)
+
+        def remove_frame_at(self, index):
+                """Returns the frame that was removed"""
+                frame = self.anim_view.animation.frames[index]
+                # a FrameView would read whatever frame moves into its slot
+                frame = frame.share(frame.duration)
                 prev_frame = self.anim_view.remove_frame(index)
+                self.record('remove_frame', index=index)
                 if not prev_frame:
                         self.anim_view.reset()
                         self.frame_view.reset()
+                        self.sheet_view.set_frames(None)
+                        self.detail_index = None
                 else:
-                        self.frame_view.set_frame(prev_frame)
+                        self.sheet_view.frame_removed(
+                                self.anim_view.animation.frames, index)
+                        self.frame_view.prune_surfaces(
+                                self.anim_view.animation.frames)
+                        self.set_detail_frame(max(index-1, 0))
+                return frame
+
+        def add_box_at(self, index, kind, rect):
+                frame = self.anim_view.animation.frames[index]
+                getattr(frame, 'add_' + kind)(rect)
+                self.record('add_box', frame=index, kind=kind, rect=list(rect))
+                self.set_detail_frame(index)
 
-        def add_hitbox(self):
-                self.frame_view.add_hitbox()
+        def remove_box_at(self, index, kind, box):
+                frame = self.anim_view.animation.frames[index]
+                getattr(frame, 'remove_' + kind)(box)
+                self.record('remove_box', frame=index, kind=kind, index=box)
+                self.set_detail_frame(index)
 
-        def add_damagebox(self):
-                self.frame_view.add_damagebox()
+        def set_box_at(self, index, kind, box, rect):
+                frame = self.anim_view.animation.frames[index]
+                getattr(frame, 'set_' + kind)(box, rect)
+                self.record('set_box', frame=index, kind=kind, index=box,
+                            rect=list(rect))
+                self.set_detail_frame(index)
+
+        def set_duration_at(self, index, duration):
+                self.anim_view.animation.frames[index].duration = duration
+                self.anim_view.animation.invalidate()
+                self.record('set_duration', frame=index, duration=duration)
+                self.set_detail_frame(index)
 
         def play_animation(self, loop):
                 self.anim_view.loop = loop
                 self.anim_view.play_animation()
 
         def save_animation(self, name):
-                return animation.save_animation(
-                        self.anim_view.animation,
-                        self.sheetpath,
-                        name)
+                """Saves on the journal's worker thread and moves the journal
+                over to the new file. Returns a Future."""
+                if not self.anim_view.animation:
+                        raise Exception('Invalid Animation')
+                if not self.journal:
+                        # nothing was being journaled, start from this save
+                        self.journal = EditJournal(journal_path(name), None,
+                                                   self.sheetpath)
+                return self.journal.compact(self.anim_view.animation, name,
+                                            journal_path(name))
 
         def load_animation(self, name):
-                sheet, anim = animation.load_animation(name)
-                self.anim_view.animation = anim
+                sheet, anim = animation.open_animation(name)
+                self.set_animation(anim)
                 return sheet
+
+        def set_animation(self, anim):
+                self.anim_view.animation = anim
+                self.anim_view.invalidate()
+                self.sheet_view.set_frames(anim.frames if anim else None)
+                self.frame_view.clear_surfaces()
+                self.history.clear()
+                self.modified = False
                 
 
         def set_duration(self, val):
                 if self.frame_view.frame and val > 0:
-                        self.frame_view.frame.duration = val
+                        if val == self.frame_view.frame.duration:
+                                return
+                        if self.detail_index is not None:
+                                self.execute(history.SetDuration(
+                                        self.detail_index,
+                                        self.frame_view.frame.duration, val))
 
         def get_frame_duration(self):
                 return self.frame_view.frame.duration
@@ -116,9 +323,16 @@ class View:
         def reset(self):
                 for view in self.subviews:
                         view.reset()
+                self.detail_index = None
+                self.history.clear()
+                self.modified = False
                 
                 
 class App:
+        # ms between autosaves; a journal untouched for several of these
+        # is taken to have been left behind by a crashed editor
+        AUTOSAVE_INTERVAL = 15000
+
         def __init__(self, master):
                 self.master = master
                 self.master.title("Bones Animation Tool")
@@ -126,9 +340,25 @@ class App:
                 frame.pack()
                 self.spritesheet = None
                 self.frame_count = 0
+                self.sheets = TiledSheetCache()
+                self.docpath = None
+                self.project = None
+                self.animation_name = None
+                self.loader = Loader()
 
                 self.view = View(frame, 800, 600)
 
+                Label(frame, text="Animation").pack()
+                self.animationBox = ttk.Combobox(frame, state='readonly')
+                self.animationBox.bind('<<ComboboxSelected>>',
+                                       self.onswitch)
+                self.animationBox.pack()
+                self.newAnimationBtn = Button(
+                        frame, text="New Animation",
+                        command=self.new_project_animation
+                        )
+                self.newAnimationBtn.pack()
+
                 Label(frame, text="Frames").pack()               
                 self.frameListbox = Listbox(frame)
                 self.frameListbox.bind('<<ListboxSelect>>', self.onselect)
@@ -140,7 +370,20 @@ class App:
                 file.add_command(label="New", command=self.new_file)
                 file.add_command(label="Open...", command=self.load_animation)
                 file.add_command(label="Save...", command=self.save_animation)
+                file.add_separator()
+                file.add_command(label="Open Project...",
+                                 command=self.open_project)
+                file.add_command(label="Save Project...",
+                                 command=self.save_project)
                 self.menu.add_cascade(label="File", menu=file)
+                edit = Menu(self.menu)
+                edit.add_command(label="Undo", accelerator="Ctrl+Z",
+                                 command=self.undo)
+                edit.add_command(label="Redo", accelerator="Ctrl+Y",
+                                 command=self.redo)
+                self.menu.add_cascade(label="Edit", menu=edit)
+                self.master.bind_all('<Control-z>', lambda e: self.undo())
+                self.master.bind_all('<Control-y>', lambda e: self.redo())
 
                 self.loadSheetBtn = Button(
                         frame, text="Load Sheet", command=self.load_sheet
@@ -162,6 +405,11 @@ class App:
                         )
                 self.addFrameBtn.pack()
 
+                self.detectFramesBtn = Button(
+                        frame, text="Detect Frames", command=self.detect_frames
+                        )
+                self.detectFramesBtn.pack()
+
                 self.deleteFrameBtn = Button(
                         frame, text="Delete Frame", command=self.delete_frame
                         )
@@ -178,6 +426,23 @@ class App:
                         )
                 self.loopCheckbtn.pack()
 
+                self.onion = BooleanVar()
+                self.onionCheckbtn = Checkbutton(
+                        frame, text="onion skin", variable=self.onion,
+                        command=self.change_onion
+                        )
+                self.onionCheckbtn.pack()
+                self.onionLayers = Spinbox(frame, from_=1, to=8, width=4,
+                                           command=self.change_onion)
+                self.onionLayers.pack()
+
+                self.filmstrip = BooleanVar()
+                self.filmstripCheckbtn = Checkbutton(
+                        frame, text="filmstrip", variable=self.filmstrip,
+                        command=self.change_filmstrip
+                        )
+                self.filmstripCheckbtn.pack()
+
                 Label(frame, text="Frame Duration").pack()
                 self.duration = StringVar()
                 self.duration.trace("w", lambda name, index, mode, val=self.duration: self.change_duration(val))
@@ -185,6 +450,75 @@ class App:
                 self.frameDurationEntry.insert(0, "1")
                 self.frameDurationEntry.pack()
 
+                self.loadStatus = StringVar()
+                Label(frame, textvariable=self.loadStatus).pack()
+                self.loadProgress = ttk.Progressbar(frame, length=150,
+                                                    maximum=1.0)
+                self.loadProgress.pack()
+                self.cancelLoadBtn = Button(
+                        frame, text="Cancel Loading", command=self.cancel_loads
+                        )
+                self.cancelLoadBtn.pack()
+
+                self.status = StringVar()
+                Label(frame, textvariable=self.status, wraplength=150).pack()
+
+                if not self.recover(None):
+                        self.start_journal(None)
+                self.master.after(self.AUTOSAVE_INTERVAL, self.autosave)
+
+        def start_journal(self, docpath):
+                if self.view.journal:
+                        self.view.journal.discard()
+                self.view.journal = EditJournal(journal_path(docpath), docpath,
+                                                self.view.sheetpath)
+
+        def recover(self, docpath):
+                """Offers to restore the edits a crashed editor left behind
+                for docpath. Returns True if they were restored."""
+                stale = 3 * self.AUTOSAVE_INTERVAL / 1000
+                orphans = orphaned_journals(docpath, stale)
+                if not orphans:
+                        return False
+                name = os.path.basename(docpath) if docpath else 'a new animation'
+                restored = False
+                if messagebox.askyesno('Recover',
+                                       'Unsaved changes to %s were found. '
+                                       'Recover them?' % name):
+                        try:
+                                sheet, anim, base = recover(orphans[0])
+                                self.show_animation(sheet, anim)
+                                # the recovered edits still need saving
+                                self.view.modified = True
+                                if self.view.journal:
+                                        self.view.journal.discard()
+                                self.view.journal = EditJournal.adopt(
+                                        orphans[0], journal_path(docpath))
+                                orphans = orphans[1:]
+                                restored = True
+                        except Exception as e:
+                                messagebox.showerror('Recover', str(e))
+                for orphan in orphans:
+                        discard_journal(orphan)
+                return restored
+
+        def autosave(self):
+                journal = self.view.journal
+                if journal:
+                        if journal.pending and self.view.anim_view.animation:
+                                journal.compact(self.view.anim_view.animation)
+                        else:
+                                journal.touch()
+                self.master.after(self.AUTOSAVE_INTERVAL, self.autosave)
+
+        def change_onion(self):
+                layers = self.onionLayers.get()
+                count = int(layers) if layers.isdigit() else 1
+                self.view.set_onion(count if self.onion.get() else 0)
+
+        def change_filmstrip(self):
+                self.view.set_filmstrip(self.filmstrip.get())
+
         def change_duration(self, val):
                 if val.get().isdigit():
                         self.view.set_duration(int(val.get()))
@@ -201,48 +535,311 @@ class App:
                         self.frameListbox.insert(END, 'Frame %d' % self.frame_count)
                         self.frame_count += 1
 
+        def detect_frames(self):
+                count = self.view.detect_frames(int(self.duration.get()))
+                for i in range(count):
+                        self.frameListbox.insert(END, 'Frame %d' % self.frame_count)
+                        self.frame_count += 1
+
         def delete_frame(self):
                 if self.frameListbox.size() > 0 and self.frameListbox.curselection():
                         index = self.frameListbox.curselection()[0]
                         self.frameListbox.delete(index)
                         self.view.remove_frame(index)
 
+        def undo(self):
+                if self.view.undo():
+                        self.refresh_frames()
+
+        def redo(self):
+                if self.view.redo():
+                        self.refresh_frames()
+
+        def refresh_frames(self):
+                """Rebuilds the frame list after an undo or redo and selects
+                the frame that changed"""
+                self.frameListbox.delete(0, END)
+                count = self.view.frame_count()
+                for f in range(count):
+                        self.frameListbox.insert(END, 'Frame %d' % f)
+                self.frame_count = count
+                index = self.view.detail_index
+                if index is not None:
+                        self.frameListbox.selection_set(index)
+                        self.duration.set(str(self.view.get_frame_duration()))
+
         def play_animation(self):
                 loop = (self.loop.get() == 1)
                 self.view.play_animation(loop)
 
         def save_animation(self):
-                ftypes = [("XML file", "*.xml"), ("All Files", "*.*")]
-                f = asksaveasfile(mode='w', defaultextension=".xml",
-                                  filetypes=ftypes)
-                if f is None:
-                        return
-                xml = self.view.save_animation(f)
-                f.write(xml)
-                f.close()
+                ftypes = [("XML file", "*.xml"),
+                          ("Binary animation", "*" + animation.BINARY_EXT),
+                          ("All Files", "*.*")]
+                name = asksaveasfilename(defaultextension=".xml",
+                                         filetypes=ftypes)
+                if not name:
+                        return None
+                self.docpath = name
+                future = self.view.save_animation(name)
+                self.view.modified = False
+                self.check_saved(future)
+                return future
+
+        def check_saved(self, future):
+                """Reports a failed background save once it finishes"""
+                if not future.done():
+                        self.master.after(100, self.check_saved, future)
+                elif future.exception():
+                        self.view.modified = True
+                        messagebox.showerror('Save', str(future.exception()))
+
+        def unsaved(self):
+                """True if there are edits that haven't been saved"""
+                return self.view.modified or bool(self.project and
+                                                  self.project.modified)
+
+        def confirm_discard(self):
+                """Offers to save unsaved edits before they are dropped.
+                Returns False if the user cancelled or the save failed."""
+                if not self.unsaved():
+                        return True
+                answer = messagebox.askyesnocancel(
+                        'Unsaved Changes', 'Save your changes first?')
+                if answer is None:
+                        return False
+                if not answer:
+                        return True
+                if self.project:
+                        return self.save_project()
+                future = self.save_animation()
+                if future is None:
+                        return False
+                try:
+                        future.result()
+                except Exception:
+                        # check_saved reports it
+                        return False
+                return True
 
         def load_animation(self):
-                self.new_file()
-                ftypes = [('XML', '*.xml')]
-                file = askopenfile(initialdir=".", filetypes=ftypes)
-                sheet = self.view.load_animation(file)
-                spritesheet = pygame.image.load(sheet)
-                self.view.set_spritesheet(spritesheet)
+                if not self.confirm_discard():
+                        return
+                ftypes = [('XML', '*.xml'),
+                          ('Binary animation', '*' + animation.BINARY_EXT)]
+                name = askopenfilename(initialdir=".", filetypes=ftypes)
+                if not name:
+                        return
+                self.close_file()
+                self.docpath = name
+                if not self.recover(name):
+                        self.loader.submit('animation', read_animation, name,
+                                           lambda result: self.animation_loaded(
+                                                   name, *result),
+                                           self.load_failed)
+
+        def animation_loaded(self, name, sheet, anim):
+                if self.docpath != name:
+                        return
+                self.show_animation(sheet, anim)
+                self.start_journal(name)
+
+        def show_animation(self, sheet, anim):
+                self.view.set_animation(anim)
+                if sheet:
+                        def loaded(spritesheet):
+                                self.view.set_spritesheet(spritesheet)
+                                anim.sheet = spritesheet
+                        self.request_sheet(sheet, loaded)
                 self.view.sheetpath = sheet
-                self.view.anim_view.animation.sheet = spritesheet
-                for f in range(1,1+len(self.view.anim_view.animation.frames)):
+                for f in range(len(anim.frames)):
                         self.frameListbox.insert(END, 'Frame %d' % f)
+                self.frame_count = len(anim.frames)
 
         def new_file(self):
+                if self.confirm_discard():
+                        self.close_file()
+
+        def close_file(self):
+                """Drops the animation or project being edited, saved or
+                not"""
+                self.view.reset()
+                self.frameListbox.delete(0, END)
+                self.docpath = None
+                self.project = None
+                self.animation_name = None
+                self.loader.cancel()
+                self.refresh_animations()
+                self.start_journal(None)
+
+        def open_project(self):
+                if not self.confirm_discard():
+                        return
+                ftypes = [('Project', '*' + PROJECT_EXT)]
+                name = askopenfilename(initialdir=".", filetypes=ftypes)
+                if not name:
+                        return
+                try:
+                        project = Project.open(name)
+                except Exception as e:
+                        messagebox.showerror('Open Project', str(e))
+                        return
+                self.close_file()
+                self.project = project
+                self.refresh_animations()
+                if project.names():
+                        self.switch_animation(project.names()[0])
+
+        def save_project(self):
+                self.ensure_project()
+                self.store_animation()
+                path = self.project.path
+                if not path:
+                        ftypes = [('Project', '*' + PROJECT_EXT)]
+                        path = asksaveasfilename(defaultextension=PROJECT_EXT,
+                                                 filetypes=ftypes)
+                        if not path:
+                                return False
+                try:
+                        self.project.save(path)
+                except Exception as e:
+                        messagebox.showerror('Save Project', str(e))
+                        return False
+                return True
+
+        def ensure_project(self):
+                """Starts a project holding the animation being edited"""
+                if self.project:
+                        return
+                self.project = Project()
+                if self.docpath:
+                        name = os.path.splitext(
+                                os.path.basename(self.docpath))[0]
+                else:
+                        name = 'animation'
+                self.animation_name = name
+                self.store_animation()
+                self.refresh_animations()
+
+        def store_animation(self):
+                """Puts the animation being edited back in the project"""
+                if not self.project or self.animation_name is None:
+                        return
+                if self.animation_name in self.project and \
+                                not self.view.modified:
+                        return
+                anim = self.view.anim_view.animation or Animation(None)
+                self.project.add(self.animation_name, anim,
+                                 self.view.sheetpath)
+                # the project holds the edits now
+                self.view.modified = False
+
+        def new_project_animation(self):
+                name = simpledialog.askstring('New Animation', 'Name:')
+                if not name:
+                        return
+                self.ensure_project()
+                if name in self.project:
+                        messagebox.showerror('New Animation',
+                                             '%s already exists' % name)
+                        return
+                self.store_animation()
+                self.project.add(name, Animation(None), self.view.sheetpath)
+                self.refresh_animations()
+                self.switch_animation(name)
+
+        def refresh_animations(self):
+                names = self.project.names() if self.project else []
+                self.animationBox['values'] = names
+                self.animationBox.set(self.animation_name or '')
+
+        def onswitch(self, evt):
+                name = self.animationBox.get()
+                if name and name != self.animation_name:
+                        self.switch_animation(name)
+
+        def switch_animation(self, name):
+                """Shows another of the project's animations. Sheets come
+                from the sheet cache, so animations sharing a sheet don't
+                load it again."""
+                self.store_animation()
+                anim = self.project.load(name)
                 self.view.reset()
                 self.frameListbox.delete(0, END)
+                self.animation_name = name
+                self.show_animation(self.project.sheet_path(name), anim)
+                self.animationBox.set(name)
+                # the journal follows the animation on screen, starting
+                # from a snapshot of it
+                self.start_journal(None)
+                self.view.journal.compact(anim)
 
         def load_sheet(self):
                 ftypes = [('BMP', '*.bmp'), ('PNG', '*.png'), ('JPG', '*.jpg')]
-                file= askopenfile(initialdir=".", filetypes = ftypes)
-                spritesheet = pygame.image.load(file)
-                self.view.set_spritesheet(spritesheet)
-                self.view.sheetpath = file.name
+                name = askopenfilename(initialdir=".", filetypes=ftypes)
+                if not name:
+                        return
+                def loaded(spritesheet):
+                        self.view.set_spritesheet(spritesheet)
+                        self.view.set_sheetpath(name)
+                self.request_sheet(name, loaded)
+
+        def request_sheet(self, path, done):
+                """Calls done with the sheet at path, straight away if it is
+                cached and otherwise once a worker has decoded it"""
+                try:
+                        sheet = self.sheets.cached(path)
+                except OSError as e:
+                        self.load_failed(e)
+                        return
+                if sheet is not None:
+                        self.loader.cancel('sheet')
+                        done(sheet)
+                        return
+
+                def decoded(result):
+                        mtime, decoded = result
+                        sheet = self.sheets.finish(decoded)
+                        self.sheets.store(os.path.abspath(path), mtime, sheet)
+                        done(sheet)
+                self.loader.submit('sheet', decode_sheet(self.sheets), path,
+                                   decoded, self.load_failed)
+
+        def show_status(self, text):
+                """Shows a one-off message under the load controls"""
+                self.status.set(text)
+
+        def load_failed(self, error):
+                messagebox.showerror('Load', str(error))
+
+        def cancel_loads(self):
+                self.loader.cancel()
+                self.show_loads()
+
+        def show_loads(self):
+                """Shows what is loading and how far along it is"""
+                pending = self.loader.pending()
+                if not pending and not self.loadStatus.get():
+                        return
+                if not pending:
+                        self.loadStatus.set('')
+                        self.loadProgress.stop()
+                        self.loadProgress.configure(mode='determinate',
+                                                    value=0)
+                        return
+                request = pending[0]
+                self.loadStatus.set('Loading %s' %
+                                    os.path.basename(request.path))
+                if request.progress is None:
+                        # decoding a sheet doesn't say how far along it is
+                        if str(self.loadProgress['mode']) != 'indeterminate':
+                                self.loadProgress.configure(
+                                        mode='indeterminate')
+                                self.loadProgress.start()
+                else:
+                        self.loadProgress.stop()
+                        self.loadProgress.configure(mode='determinate',
+                                                    value=request.progress)
 
         def onselect(self, evt):
                 w = evt.widget
@@ -258,6 +855,13 @@ class App:
                 self.duration.set(str(current_duration))
                 self.frameListbox.select_anchor(index)
 
+        def select_frame(self, index):
+                """Selects a frame in the list as if it had been clicked"""
+                self.frameListbox.selection_clear(0, END)
+                self.frameListbox.selection_set(index)
+                self.frameListbox.see(index)
+                self.set_listbox_selection(index)
+
         def down_key(self):
                 self.frameListbox.focus_set()
                 if not self.frameListbox.curselection():
@@ -282,14 +886,90 @@ class App:
                                 self.set_listbox_selection(index-1)
 
         def mainloop(self):
-                self.view.mainloop(self)
-                
+                finished = self.loader.poll()
+                self.show_loads()
+                return self.view.mainloop(self) or finished
+
+        def quit(self):
+                journal = self.view.journal
+                if journal:
+                        journal.close()
+                        # nothing left to recover once everything is saved
+                        if self.project:
+                                # the journal is based on an autosave
+                                # snapshot taken on switching animations,
+                                # never on the project file, so only the
+                                # project says whether anything is unsaved
+                                clean = not self.unsaved()
+                        else:
+                                saved = (self.docpath and journal.base and
+                                         os.path.abspath(journal.base) ==
+                                         os.path.abspath(self.docpath))
+                                clean = not journal.pending and \
+                                        (saved or not journal.base)
+                        if clean:
+                                discard_journal(journal.path)
+                # custom builds can collect a trace of the whole session
+                trace = os.environ.get('BONES_TRACE')
+                if trace:
+                        self.view.profiler.dump_trace(trace)
+                self.loader.shutdown()
+                self.scheduler.stop()
+
+
+class Scheduler:
+        """Drives pygame from inside Tk's event loop.
+
+        The pygame side runs at animation.FPS while an animation plays or
+        something is being dragged, and backs off to IDLE_INTERVAL ms once
+        input stops, so an idle editor spends its time asleep in Tk.
+        """
+        IDLE_INTERVAL = 100
+
+        def __init__(self, root, app):
+                self.root = root
+                self.app = app
+                self.app.scheduler = self
+                self.frame_ms = 1000 // animation.FPS
+                self.delay = self.frame_ms
+                self.job = None
+                self.running = False
+
+        def start(self):
+                self.running = True
+                self.root.protocol('WM_DELETE_WINDOW', self.app.quit)
+                self.job = self.root.after(0, self.run)
+                self.root.mainloop()
+
+        def run(self):
+                self.job = None
+                if not self.running:
+                        return
+                started = time.perf_counter()
+                had_input = self.app.mainloop()
+                if not self.running:
+                        return
+                if had_input or self.app.view.is_busy():
+                        self.delay = self.frame_ms
+                else:
+                        self.delay = min(self.delay * 2, self.IDLE_INTERVAL)
+                spent = int((time.perf_counter() - started) * 1000)
+                self.job = self.root.after(max(1, self.delay - spent), self.run)
+
+        def stop(self):
+                if not self.running:
+                        return
+                self.running = False
+                if self.job:
+                        self.root.after_cancel(self.job)
+                        self.job = None
+                pygame.quit()
+                self.root.destroy()
 
-root = Tk()
-root.title('Animation Tool')
 
-app = App(root)
+if __name__ == '__main__':
+        root = Tk()
+        root.title('Animation Tool')
 
-while True:
-        app.mainloop()
-        root.update()
+        app = App(root)
+        Scheduler(root, app).start()
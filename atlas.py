@@ -0,0 +1,171 @@
+import hashlib
+import pygame
+from trim import trim_rect
+
+
+def next_pow2(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+class MaxRectsBin:
+    """MaxRects packer using the best short side fit heuristic"""
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.free = [pygame.Rect(0, 0, width, height)]
+        self.used = []
+
+    def copy(self):
+        other = MaxRectsBin(self.width, self.height)
+        other.free = [r.copy() for r in self.free]
+        other.used = [r.copy() for r in self.used]
+        return other
+
+    def insert(self, w, h):
+        """Places a w x h rect, returns where or None if it doesn't fit"""
+        best = None
+        best_fit = None
+        for free in self.free:
+            if free.w >= w and free.h >= h:
+                leftover = (free.w - w, free.h - h)
+                fit = (min(leftover), max(leftover))
+                if best_fit is None or fit < best_fit:
+                    best = pygame.Rect(free.x, free.y, w, h)
+                    best_fit = fit
+        if best:
+            self._split(best)
+            self.used.append(best)
+        return best
+
+    def _split(self, used):
+        kept, created = [], []
+        for free in self.free:
+            if not free.colliderect(used):
+                kept.append(free)
+                continue
+            # the maximal free rects left around used inside free
+            if used.x > free.x:
+                created.append(pygame.Rect(free.x, free.y,
+                                           used.x - free.x, free.h))
+            if used.right < free.right:
+                created.append(pygame.Rect(used.right, free.y,
+                                           free.right - used.right, free.h))
+            if used.y > free.y:
+                created.append(pygame.Rect(free.x, free.y,
+                                           free.w, used.y - free.y))
+            if used.bottom < free.bottom:
+                created.append(pygame.Rect(free.x, used.bottom,
+                                           free.w, free.bottom - used.bottom))
+        # drop the new rects that lie inside another free rect
+        pruned = []
+        for i, rect in enumerate(created):
+            if any(other.contains(rect) for other in kept):
+                continue
+            if any(other.contains(rect) and (other != rect or j < i)
+                   for j, other in enumerate(created) if j != i):
+                continue
+            pruned.append(rect)
+        self.free = kept + pruned
+
+    def bounds(self):
+        """Returns the size needed to hold everything placed so far"""
+        if not self.used:
+            return (0, 0)
+        return (max(r.right for r in self.used),
+                max(r.bottom for r in self.used))
+
+
+class Page:
+    """One atlas texture being packed"""
+    def __init__(self, size):
+        self.bin = MaxRectsBin(size, size)
+        self.blocks = {}
+
+    def place(self, blocks, padding):
+        """Packs every block not already on the page, all or nothing.
+        blocks is a list of (key, w, h). Returns True on success."""
+        trial = self.bin.copy()
+        placed = {}
+        missing = [b for b in blocks if b[0] not in self.blocks]
+        missing.sort(key=lambda b: (max(b[1], b[2]), b[1] * b[2]),
+                     reverse=True)
+        for key, w, h in missing:
+            if key in placed:
+                continue
+            rect = trial.insert(w + padding, h + padding)
+            if not rect:
+                return False
+            placed[key] = pygame.Rect(rect.x, rect.y, w, h)
+        self.bin = trial
+        self.blocks.update(placed)
+        return True
+
+
+def block_key(sheet, rect):
+    """Identifies a block of pixels by its size and a hash of its contents"""
+    pixels = pygame.image.tostring(sheet.subsurface(rect), 'RGBA')
+    return (rect.w, rect.h, hashlib.blake2b(pixels, digest_size=16).digest())
+
+
+def pack_atlases(animations, max_size=2048, padding=1, trim=True):
+    """Repacks the frames of many animations into power of two atlases.
+
+    animations is a list of (sheet, animation). Every frame's pixels are
+    trimmed (if trim is set) and identical blocks are stored once per
+    atlas. All frames of one animation land on the same atlas since an
+    animation names a single spritesheet. Frame rects are rewritten in
+    place and boxes shifted to stay on the sprite. Returns (atlases,
+    pages) where pages[i] is the atlas index of animations[i].
+    """
+    sources = {}
+    plans = []
+    for sheet, anim in animations:
+        plan = []
+        for frame in anim.frames:
+            rect = frame.rect.clip(sheet.get_rect())
+            region = trim_rect(sheet, rect) if trim else rect
+            if not region:
+                # nothing visible, keep a single pixel to point at
+                region = pygame.Rect(rect.x, rect.y, 1, 1)
+            key = block_key(sheet, region)
+            sources.setdefault(key, (sheet, region))
+            dx, dy = region.x - frame.rect.x, region.y - frame.rect.y
+            plan.append((key, dx, dy))
+        plans.append(plan)
+
+    pages = []
+    assignment = []
+    for (sheet, anim), plan in zip(animations, plans):
+        blocks = [(key, key[0], key[1]) for key, dx, dy in plan]
+        for index, page in enumerate(pages):
+            if page.place(blocks, padding):
+                break
+        else:
+            page = Page(max_size)
+            if not page.place(blocks, padding):
+                raise Exception('Animation frames don\'t fit in a %dx%d atlas'
+                                % (max_size, max_size))
+            pages.append(page)
+            index = len(pages) - 1
+        assignment.append(index)
+        for frame, (key, dx, dy) in zip(anim.frames, plan):
+            frame.rect = page.blocks[key].copy()
+            frame.hitboxes = [box.move(-dx, -dy) for box in frame.hitboxes]
+            frame.damageboxes = [box.move(-dx, -dy)
+                                 for box in frame.damageboxes]
+
+    atlases = []
+    for page in pages:
+        w, h = page.bin.bounds()
+        atlas = pygame.Surface((next_pow2(w), next_pow2(h)), pygame.SRCALPHA,
+                               32)
+        atlas.fill((0, 0, 0, 0))
+        for key, rect in page.blocks.items():
+            sheet, region = sources[key]
+            # adding onto the cleared atlas copies the pixels exactly
+            atlas.blit(sheet, rect, region,
+                       special_flags=pygame.BLEND_RGBA_ADD)
+        atlases.append(atlas)
+    return atlases, assignment
@@ -0,0 +1,271 @@
+"""Headless batch tools for animation files.
+
+    python batch.py validate assets/
+    python batch.py convert --to binary --out build/anims assets/
+    python batch.py retrim assets/hero/
+    python batch.py pack --out build/atlas assets/hero/
+    python batch.py bundle --out build/hero.bproj assets/hero/
+
+Directories are searched recursively for .xml and .banim animations and
+the files are processed across a pool of worker processes, except for
+pack and bundle which have to see every animation at once. Nothing here opens a
+display or Tk.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame
+import animation
+from atlas import pack_atlases
+from project import Project
+from sheetcache import SheetCache
+from trim import trim_rect
+
+ANIMATION_EXTS = ('.xml', animation.BINARY_EXT)
+
+# one cache per worker process, animations in a tree tend to share sheets
+_sheets = SheetCache()
+
+
+def find_animations(paths):
+    """Yields (file, root) for every animation file under paths"""
+    for root in paths:
+        if os.path.isfile(root):
+            yield root, os.path.dirname(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(ANIMATION_EXTS):
+                    yield os.path.join(dirpath, name), root
+
+
+def is_binary(path):
+    with open(path, 'rb') as f:
+        return f.read(len(animation.BINARY_MAGIC)) == animation.BINARY_MAGIC
+
+
+def resolve_sheet(sheetpath, animpath):
+    """Sheet paths are tried as given, then relative to the animation"""
+    if os.path.isabs(sheetpath) or os.path.exists(sheetpath):
+        return sheetpath
+    return os.path.join(os.path.dirname(animpath), sheetpath)
+
+
+def write_animation(anim, sheetpath, outpath, binary):
+    if binary:
+        with open(outpath, 'wb') as f:
+            f.write(animation.save_animation_binary(anim, sheetpath, outpath))
+    else:
+        animation.save_animation_file(anim, sheetpath, outpath)
+
+
+def _inside(box, rect):
+    box = pygame.Rect(box)
+    box.normalize()
+    return rect.contains(box)
+
+
+def validate(path, options):
+    sheetpath, anim = animation.open_animation(path)
+    problems = []
+    try:
+        sheet_rect = _sheets.load(resolve_sheet(sheetpath, path)).get_rect()
+    except (OSError, pygame.error) as e:
+        problems.append('spritesheet %s: %s' % (sheetpath, e))
+        sheet_rect = None
+    for i, frame in enumerate(anim.frames):
+        rect = frame.rect
+        if frame.duration <= 0:
+            problems.append('frame %d: duration %d' % (i, frame.duration))
+        if rect.w <= 0 or rect.h <= 0:
+            problems.append('frame %d: empty rect %s' % (i, frame))
+        elif sheet_rect and not sheet_rect.contains(rect):
+            problems.append('frame %d: rect %s outside spritesheet'
+                            % (i, frame))
+        bounds = pygame.Rect(0, 0, rect.w, rect.h)
+        for kind, boxes in (('hitbox', frame.hitboxes),
+                            ('damagebox', frame.damageboxes)):
+            for j, box in enumerate(boxes):
+                if not _inside(box, bounds):
+                    problems.append('frame %d: %s %d %s outside frame'
+                                    % (i, kind, j, list(box)))
+    return problems
+
+
+def convert(path, options):
+    sheetpath, anim = animation.open_animation(path)
+    binary = options['to'] == 'binary'
+    ext = animation.BINARY_EXT if binary else '.xml'
+    outpath = os.path.splitext(path)[0] + ext
+    if options['out']:
+        relpath = os.path.relpath(outpath, options['root'])
+        outpath = os.path.join(options['out'], relpath)
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        if not os.path.isabs(sheetpath):
+            # keep relative sheet references pointing at the same file
+            sheet = resolve_sheet(sheetpath, path)
+            sheetpath = os.path.relpath(sheet, os.path.dirname(outpath))
+    write_animation(anim, sheetpath, outpath, binary)
+    return []
+
+
+def retrim(path, options):
+    """Shrinks every frame rect to its sprite again, keeping the boxes
+    where they were on the sprite"""
+    sheetpath, anim = animation.open_animation(path)
+    sheet = _sheets.load(resolve_sheet(sheetpath, path))
+    problems = []
+    changed = False
+    for i, frame in enumerate(anim.frames):
+        rect = frame.rect
+        trimmed = trim_rect(sheet, rect)
+        if not trimmed:
+            problems.append('frame %d: no sprite inside %s' % (i, frame))
+            continue
+        if trimmed == rect:
+            continue
+        dx, dy = trimmed.x - rect.x, trimmed.y - rect.y
+        frame.rect = trimmed
+        frame.hitboxes = [box.move(-dx, -dy) for box in frame.hitboxes]
+        frame.damageboxes = [box.move(-dx, -dy) for box in frame.damageboxes]
+        changed = True
+    if changed:
+        write_animation(anim, sheetpath, path, is_binary(path))
+    return problems
+
+
+def pack(paths, out, max_size, padding):
+    """Repacks every animation under paths into shared atlases written to
+    out, along with the rewritten animations"""
+    start = time.perf_counter()
+    found = list(find_animations(paths))
+    loaded = []
+    for path, root in found:
+        sheetpath, anim = animation.open_animation(path)
+        sheet = _sheets.load(resolve_sheet(sheetpath, path))
+        loaded.append((sheet, anim))
+    atlases, pages = pack_atlases(loaded, max_size, padding)
+
+    os.makedirs(out, exist_ok=True)
+    atlas_paths = []
+    for i, atlas in enumerate(atlases):
+        atlas_paths.append(os.path.join(out, 'atlas%d.png' % i))
+        pygame.image.save(atlas, atlas_paths[-1])
+    for (path, root), (sheet, anim), page in zip(found, loaded, pages):
+        outpath = os.path.join(out, os.path.relpath(path, root))
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        sheetpath = os.path.relpath(atlas_paths[page],
+                                    os.path.dirname(outpath))
+        write_animation(anim, sheetpath, outpath, is_binary(path))
+
+    frames = sum(len(anim.frames) for sheet, anim in loaded)
+    sizes = ', '.join('%dx%d' % atlas.get_size() for atlas in atlases)
+    print('%d animations, %d frames packed into %d atlases (%s), %.2f s'
+          % (len(loaded), frames, len(atlases), sizes,
+             time.perf_counter() - start))
+    return 0
+
+
+def bundle(paths, out):
+    """Gathers every animation under paths into one project file, named
+    by their paths under the directory they were found in"""
+    start = time.perf_counter()
+    project = Project()
+    for path, root in find_animations(paths):
+        sheetpath, anim = animation.open_animation(path)
+        name = os.path.splitext(os.path.relpath(path, root))[0]
+        if sheetpath:
+            sheetpath = resolve_sheet(sheetpath, path)
+        project.add(name.replace(os.sep, '/'), anim, sheetpath)
+    project.save(out)
+    print('%d animations, %d sheets bundled into %s, %.2f s'
+          % (len(project), len(project.sheets), out,
+             time.perf_counter() - start))
+    return 0
+
+
+COMMANDS = {
+    'validate': validate,
+    'convert': convert,
+    'retrim': retrim,
+}
+
+
+def run_task(command, path, options):
+    """Runs one command on one file in a worker. Returns (path, problems,
+    seconds)."""
+    start = time.perf_counter()
+    try:
+        problems = COMMANDS[command](path, options)
+    except Exception as e:
+        problems = ['%s: %s' % (type(e).__name__, e)]
+    return path, problems, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per cpu)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only report files with problems')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sub = commands.add_parser('validate', help='check rects, durations '
+                                               'and boxes')
+    sub.add_argument('paths', nargs='+')
+    sub = commands.add_parser('retrim', help='shrink frame rects to their '
+                                             'sprites again')
+    sub.add_argument('paths', nargs='+')
+    sub = commands.add_parser('convert', help='rewrite as xml or binary')
+    sub.add_argument('--to', choices=('xml', 'binary'), required=True)
+    sub.add_argument('--out', help='write into this directory tree instead '
+                                   'of next to each file')
+    sub.add_argument('paths', nargs='+')
+    sub = commands.add_parser('pack', help='repack frames into shared '
+                                           'atlases')
+    sub.add_argument('--out', required=True)
+    sub.add_argument('--max-size', type=int, default=2048,
+                     help='largest atlas side (default: 2048)')
+    sub.add_argument('--padding', type=int, default=1)
+    sub.add_argument('paths', nargs='+')
+    sub = commands.add_parser('bundle', help='gather animations into a '
+                                             'project file')
+    sub.add_argument('--out', required=True)
+    sub.add_argument('paths', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        return pack(args.paths, args.out, args.max_size, args.padding)
+    if args.command == 'bundle':
+        return bundle(args.paths, args.out)
+
+    start = time.perf_counter()
+    failed = 0
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = []
+        for path, root in find_animations(args.paths):
+            options = {'to': getattr(args, 'to', None),
+                       'out': getattr(args, 'out', None),
+                       'root': root}
+            futures.append(pool.submit(run_task, args.command, path, options))
+        for future in as_completed(futures):
+            path, problems, seconds = future.result()
+            total += 1
+            if problems:
+                failed += 1
+            if problems or not args.quiet:
+                status = 'FAIL' if problems else 'ok'
+                print('%8.1f ms  %-4s  %s' % (seconds * 1000, status, path))
+                for problem in problems:
+                    print('                  %s' % problem)
+    print('%d files, %d with problems, %.2f s'
+          % (total, failed, time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Headless benchmarks of the editor's hot paths.
+
+    python benchmark.py --out results.json
+    python benchmark.py --baseline results.json --out new.json
+    python benchmark.py --quick --filter load
+
+Every benchmark runs on synthetic data made from fixed seeds with the SDL
+dummy video driver, so runs on the same machine are comparable. Each one
+is timed as the best of several repeats. With --baseline the results are
+compared against an earlier run and the exit code is 1 if anything got
+slower by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import numpy
+import pygame
+import animation
+from animation import Animation, AnimationPlayer, AnimFrame
+from profiler import Profiler
+from subview import SpritesheetSubView
+from tiledsheet import TiledSheet
+
+FRAME_COUNTS = (10, 100, 1000, 10000, 100000)
+QUICK_FRAME_COUNTS = (10, 100, 1000)
+SELECTION_SIZES = (32, 128, 512, 2048)
+INSTANCE_COUNTS = (100, 1000, 10000)
+SHEET_SIZE = 4096
+ZOOMS = (0.125, 0.5, 1, 4, 16)
+# how long to keep repeating a benchmark, and the most repeats to take
+MIN_TIME = 0.2
+MAX_REPEATS = 50
+
+
+def synthetic_animation(count, sheet=None, seed=0):
+    """count frames on a 64px grid, each with a hitbox and a damagebox"""
+    rng = numpy.random.default_rng(seed)
+    anim = Animation(sheet)
+    values = rng.integers(0, 32, (count, 9)).tolist()
+    for i, (dur, hx, hy, hw, hh, dx, dy, dw, dh) in enumerate(values):
+        frame = AnimFrame(pygame.Rect(i % 64 * 64, i // 64 % 64 * 64, 64, 64))
+        frame.duration = dur + 1
+        frame.hitboxes.append(pygame.Rect(hx, hy, hw + 1, hh + 1))
+        frame.damageboxes.append(pygame.Rect(dx, dy, dw + 1, dh + 1))
+        anim.frames.append(frame)
+    return anim
+
+
+def synthetic_sheet(size=SHEET_SIZE, sprites=4000, seed=0):
+    """A transparent sheet scattered with opaque rectangles"""
+    rng = numpy.random.default_rng(seed)
+    sheet = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+    sheet.fill((0, 0, 0, 0))
+    for x, y, w, h, c in rng.integers(0, size - 64, (sprites, 5)).tolist():
+        sheet.fill((c % 256, 80, 160, 255), (x, y, w % 60 + 4, h % 60 + 4))
+    return sheet
+
+
+class Host:
+    """Just enough of View for subviews to be built without Tk"""
+    def __init__(self):
+        pygame.font.init()
+        self.font = pygame.font.Font(None, 16)
+        self.profiler = Profiler()
+
+
+def measure(fn):
+    """Runs fn until MIN_TIME has passed or MAX_REPEATS runs, after one
+    warm up run. Returns stats in seconds."""
+    fn()
+    times = []
+    total = 0.0
+    while total < MIN_TIME and len(times) < MAX_REPEATS:
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        total += times[-1]
+    return {'best': min(times), 'median': float(numpy.median(times)),
+            'repeats': len(times)}
+
+
+def file_benchmarks(tmp, counts):
+    for count in counts:
+        anim = synthetic_animation(count)
+        xml_path = os.path.join(tmp, 'anim%d.xml' % count)
+        bin_path = os.path.join(tmp, 'anim%d%s' % (count, animation.BINARY_EXT))
+        with open(xml_path, 'w') as f:
+            f.write(animation.save_animation(anim, 'sheet.png', xml_path))
+        with open(bin_path, 'wb') as f:
+            f.write(animation.save_animation_binary(anim, 'sheet.png',
+                                                    bin_path))
+        yield ('save_xml/%d' % count,
+               lambda: animation.save_animation(anim, 'sheet.png', xml_path))
+        yield ('load_xml/%d' % count,
+               lambda: animation.load_animation(xml_path))
+        yield ('save_binary/%d' % count,
+               lambda: animation.save_animation_binary(anim, 'sheet.png',
+                                                       bin_path))
+        yield ('load_binary/%d' % count,
+               lambda: animation.load_animation_binary(bin_path))
+        yield ('load_compact/%d' % count,
+               lambda: animation.load_animation_binary(bin_path, True))
+
+
+def trim_benchmarks(host, sheet, sizes):
+    view = SpritesheetSubView(host, (0, 0, 800, 300))
+    view.spritesheet = sheet
+    for size in sizes:
+        rect = pygame.Rect(0, 0, size, size)
+        rect.center = sheet.get_rect().center
+        yield ('shrink_frame/%d' % size,
+               lambda: view.shrink_frame(sheet, rect))
+
+
+def playback_benchmarks(screen, sheet, counts):
+    anim = synthetic_animation(256, sheet)
+    for count in counts:
+        copies = [synthetic_animation(16, sheet, i) for i in range(count)]
+
+        def step():
+            for copy in copies:
+                copy.step()
+
+        def draw():
+            for i, copy in enumerate(copies):
+                copy.draw(screen, i % 700, i // 700 % 500)
+        yield 'animation_step/%d' % count, step
+        yield 'animation_draw/%d' % count, draw
+
+        player = AnimationPlayer(anim, count)
+        for i in range(count):
+            player.add(i % 700, i // 700 % 500, tick=i)
+        yield 'player_step/%d' % count, player.step
+        yield 'player_draw/%d' % count, lambda: player.draw(screen)
+
+
+def sheet_view_benchmarks(host, screen, sheet, tiled, zooms):
+    for name, source in (('surface', sheet), ('tiled', tiled)):
+        view = SpritesheetSubView(host, (0, 0, 800, 300))
+        view.spritesheet = source
+        for zoom in zooms:
+            # pan a little every draw so nothing zoomed is reused as is
+            def draw(view=view, zoom=zoom):
+                view.zoom = zoom
+                view.pan(7, 3)
+                view.draw(screen)
+            yield 'sheet_view_draw/%s/%s' % (name, zoom), draw
+
+
+def run(args):
+    pygame.display.init()
+    screen = pygame.display.set_mode((800, 600))
+    host = Host()
+    # the tiled sheet's file stays mapped until run returns, which
+    # Windows won't delete under it
+    with tempfile.TemporaryDirectory(prefix='bones-bench-',
+                                     ignore_cleanup_errors=True) as tmp:
+        sheet = synthetic_sheet()
+        sheet_path = os.path.join(tmp, 'sheet.png')
+        pygame.image.save(sheet, sheet_path)
+        sheet = sheet.convert_alpha()
+        tiled = TiledSheet(sheet_path, tile_dir=os.path.join(tmp, 'tiles'))
+
+        counts = QUICK_FRAME_COUNTS if args.quick else FRAME_COUNTS
+        instances = INSTANCE_COUNTS[:-1] if args.quick else INSTANCE_COUNTS
+        groups = [file_benchmarks(tmp, counts),
+                  trim_benchmarks(host, sheet, SELECTION_SIZES),
+                  playback_benchmarks(screen, sheet, instances),
+                  sheet_view_benchmarks(host, screen, sheet, tiled, ZOOMS)]
+        results = {}
+        for group in groups:
+            for name, fn in group:
+                if args.filter and args.filter not in name:
+                    continue
+                results[name] = measure(fn)
+                if not args.quiet:
+                    print('%-36s %12.3f ms'
+                          % (name, results[name]['best'] * 1000))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints how results moved against baseline. Returns the names that
+    got slower than threshold times the baseline."""
+    slower = []
+    print('%-36s %12s %12s %8s' % ('benchmark', 'baseline ms', 'now ms',
+                                   'ratio'))
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if not old:
+            print('%-36s %12s %12.3f %8s' % (name, '-', stats['best'] * 1000,
+                                             'new'))
+            continue
+        ratio = stats['best'] / old['best'] if old['best'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            slower.append(name)
+            flag = '  SLOWER'
+        print('%-36s %12.3f %12.3f %7.2fx%s'
+              % (name, old['best'] * 1000, stats['best'] * 1000, ratio, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', help='write the results here as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio counted as a regression '
+                             '(default: 1.2)')
+    parser.add_argument('--filter', help='only run benchmarks whose name '
+                                         'contains this')
+    parser.add_argument('--quick', action='store_true',
+                        help='skip the largest sizes')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {'meta': {'python': platform.python_version(),
+                       'pygame': pygame.version.ver,
+                       'numpy': numpy.__version__,
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import weakref
+import numpy
+
+_tables = weakref.WeakKeyDictionary()
+
+
+class BoxTable:
+    """Hitboxes and damageboxes of every frame of an animation, packed into
+    (n, 4) arrays with an offsets array per kind, so the boxes of frame i
+    are boxes[offsets[i]:offsets[i+1]]. Boxes are normalized."""
+    def __init__(self, animation):
+        hits, dmgs = [], []
+        hit_offsets, dmg_offsets = [0], [0]
+        for frame in animation.frames:
+            hits.extend(tuple(box) for box in frame.hitboxes)
+            dmgs.extend(tuple(box) for box in frame.damageboxes)
+            hit_offsets.append(len(hits))
+            dmg_offsets.append(len(dmgs))
+        self.hitboxes = _normalized(hits)
+        self.damageboxes = _normalized(dmgs)
+        self.hit_offsets = numpy.array(hit_offsets, dtype=numpy.int64)
+        self.dmg_offsets = numpy.array(dmg_offsets, dtype=numpy.int64)
+
+    @classmethod
+    def of(cls, animation):
+        """Returns the cached table for animation, building it if needed"""
+        table = _tables.get(animation)
+        if table is None:
+            table = _tables[animation] = cls(animation)
+        return table
+
+
+def forget(animation):
+    """Drops animation's cached BoxTable; call after editing its boxes"""
+    _tables.pop(animation, None)
+
+
+def _normalized(boxes):
+    boxes = numpy.array(boxes, dtype=numpy.int64).reshape(-1, 4)
+    flipped = boxes[:, 2:] < 0
+    boxes[:, :2] += numpy.where(flipped, boxes[:, 2:], 0)
+    boxes[:, 2:] = numpy.abs(boxes[:, 2:])
+    return boxes
+
+
+def _gather(boxes, offsets, frames, positions):
+    """World space boxes of the given frames. Returns (boxes, owner, index)
+    where owner is the position in frames each box came from and index is
+    the box's index within its frame."""
+    first = offsets[frames]
+    counts = offsets[frames + 1] - first
+    owner = numpy.repeat(numpy.arange(len(frames)), counts)
+    run_start = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    index = numpy.arange(len(owner)) - run_start
+    world = boxes[first[owner] + index].copy()
+    world[:, :2] += positions[owner]
+    return world, owner, index
+
+
+def _cells(boxes, cell_size):
+    """Expands boxes into one (box, cell key) entry per grid cell touched"""
+    lo = boxes[:, :2] // cell_size
+    hi = (boxes[:, :2] + boxes[:, 2:] - 1) // cell_size
+    span = numpy.maximum(hi - lo + 1, 0)
+    # empty boxes touch no cells
+    span[(boxes[:, 2] == 0) | (boxes[:, 3] == 0)] = 0
+    counts = span[:, 0] * span[:, 1]
+    box = numpy.repeat(numpy.arange(len(boxes)), counts)
+    k = numpy.arange(len(box)) - numpy.repeat(numpy.cumsum(counts) - counts,
+                                              counts)
+    width = span[box, 0]
+    cx = lo[box, 0] + k % width
+    cy = lo[box, 1] + k // width
+    return box, _key(cx, cy)
+
+
+def _key(cx, cy):
+    return (cx << 32) + (cy & 0xffffffff)
+
+
+def overlaps(hits, dmgs, cell_size=None):
+    """Finds every overlapping (hitbox, damagebox) pair.
+
+    hits and dmgs are (n, 4) arrays of normalized world space boxes. A
+    uniform grid narrows the candidates down before the exact AABB test.
+    Returns two arrays of matching indices into hits and dmgs.
+    """
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    if len(hits) == 0 or len(dmgs) == 0:
+        return empty, empty
+    if cell_size is None:
+        # about two average boxes across keeps cell lists short
+        extent = numpy.concatenate((hits[:, 2:], dmgs[:, 2:])).max(axis=1)
+        cell_size = max(int(extent.mean()) * 2, 1)
+
+    hit_box, hit_key = _cells(hits, cell_size)
+    dmg_box, dmg_key = _cells(dmgs, cell_size)
+    order = numpy.argsort(dmg_key, kind='stable')
+    dmg_box, dmg_key = dmg_box[order], dmg_key[order]
+
+    # pair every hit cell entry with the damage entries in the same cell
+    lo = numpy.searchsorted(dmg_key, hit_key, side='left')
+    hi = numpy.searchsorted(dmg_key, hit_key, side='right')
+    counts = hi - lo
+    entry = numpy.repeat(numpy.arange(len(hit_box)), counts)
+    k = numpy.arange(len(entry)) - numpy.repeat(numpy.cumsum(counts) - counts,
+                                                counts)
+    h = hit_box[entry]
+    d = dmg_box[lo[entry] + k]
+    cell = hit_key[entry]
+
+    a, b = hits[h], dmgs[d]
+    left = numpy.maximum(a[:, 0], b[:, 0])
+    top = numpy.maximum(a[:, 1], b[:, 1])
+    right = numpy.minimum(a[:, 0] + a[:, 2], b[:, 0] + b[:, 2])
+    bottom = numpy.minimum(a[:, 1] + a[:, 3], b[:, 1] + b[:, 3])
+    hit = (left < right) & (top < bottom)
+    # a pair sharing several cells is only kept in the cell holding the
+    # top left corner of its intersection
+    hit &= _key(left // cell_size, top // cell_size) == cell
+    return h[hit], d[hit]
+
+
+def collide_frames(groups, cell_size=None):
+    """Finds hitbox vs damagebox overlaps between instances.
+
+    groups is a sequence of (animation, ids, frames, positions): the ids of
+    some instances of animation, the frame each is showing and their (x, y)
+    positions. Returns an (m, 6) array of rows (hit group, hit id, hitbox,
+    damage group, damage id, damagebox), where hitbox and damagebox index
+    into the boxes of the instance's current frame. An instance never
+    collides with itself.
+    """
+    hit_parts, dmg_parts = [], []
+    for g, (animation, ids, frames, positions) in enumerate(groups):
+        table = BoxTable.of(animation)
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        frames = numpy.asarray(frames, dtype=numpy.int64)
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, 2)
+        for parts, boxes, offsets in ((hit_parts, table.hitboxes,
+                                       table.hit_offsets),
+                                      (dmg_parts, table.damageboxes,
+                                       table.dmg_offsets)):
+            world, owner, index = _gather(boxes, offsets, frames, positions)
+            group = numpy.full(len(owner), g, dtype=numpy.int64)
+            parts.append((world, group, ids[owner], index))
+
+    if not hit_parts:
+        return numpy.zeros((0, 6), dtype=numpy.int64)
+    hits = [numpy.concatenate(col) for col in zip(*hit_parts)]
+    dmgs = [numpy.concatenate(col) for col in zip(*dmg_parts)]
+    h, d = overlaps(hits[0], dmgs[0], cell_size)
+    rows = numpy.stack((hits[1][h], hits[2][h], hits[3][h],
+                        dmgs[1][d], dmgs[2][d], dmgs[3][d]), axis=1)
+    itself = (rows[:, 0] == rows[:, 3]) & (rows[:, 1] == rows[:, 4])
+    return rows[~itself]
+
+
+def collide(instances, cell_size=None):
+    """Same as collide_frames for a list of (animation, x, y) instances,
+    each showing its animation's current_frame. Returns an (m, 4) array of
+    (hit instance, hitbox, damage instance, damagebox) rows."""
+    by_animation = {}
+    for i, (animation, x, y) in enumerate(instances):
+        group = by_animation.setdefault(id(animation), (animation, [], [], []))
+        group[1].append(i)
+        group[2].append(animation.current_frame)
+        group[3].append((x, y))
+    rows = collide_frames(list(by_animation.values()), cell_size)
+    return rows[:, [1, 2, 4, 5]]
+
+
+def collide_players(players, cell_size=None):
+    """Same as collide_frames for every live instance of some
+    AnimationPlayers; the group columns index into players."""
+    groups = []
+    for player in players:
+        ids, frames = player.frames()
+        groups.append((player.animation, ids, frames, player.positions[ids]))
+    return collide_frames(groups, cell_size)
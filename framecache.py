@@ -0,0 +1,126 @@
+"""Cached scaled and cut out pixels for drawing.
+
+Blitting a frame straight from its spritesheet leaves no place to keep
+transformed copies. A FrameSurfaceCache cuts each frame rect out once,
+converted for the display, and keeps flipped and scaled variants next to
+it. ZoomedSheet draws a whole sheet at a zoom level without rescaling all
+of it every frame.
+"""
+import math
+import pygame
+from sheetcache import convert_sheet
+
+
+class FrameSurfaceCache:
+    """Cut out frames of one spritesheet, built lazily on first use.
+
+    Entries are keyed by the frame rect's values, so a frame whose rect
+    changes simply misses and gets a fresh surface; prune drops the ones
+    no frame uses any more.
+    """
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, rect, flip_x=False, flip_y=False, scale=1):
+        """Returns (surface, offset) for a frame rect, or None if the rect
+        misses the sheet. Blitting surface at pos + offset draws what
+        blitting the sheet at pos with rect as the area would, scaled."""
+        key = (tuple(rect), flip_x, flip_y, scale)
+        entry = self.entries.get(key)
+        if entry is None and key not in self.entries:
+            entry = self._build(pygame.Rect(rect), flip_x, flip_y, scale)
+            self.entries[key] = entry
+        return entry
+
+    def _build(self, rect, flip_x, flip_y, scale):
+        if flip_x or flip_y or scale != 1:
+            base = self.get(rect)
+            if base is None:
+                return None
+            image, (dx, dy) = base
+            if flip_x or flip_y:
+                image = pygame.transform.flip(image, flip_x, flip_y)
+                # the clipped margin moves to the other side
+                if flip_x:
+                    dx = rect.w - dx - image.get_width()
+                if flip_y:
+                    dy = rect.h - dy - image.get_height()
+            if scale != 1:
+                w, h = image.get_size()
+                size = (max(1, round(w * scale)), max(1, round(h * scale)))
+                image = pygame.transform.scale(image, size)
+                dx, dy = round(dx * scale), round(dy * scale)
+            return image, (dx, dy)
+        clipped = rect.clip(self.sheet.get_rect())
+        if not clipped:
+            return None
+        image = convert_sheet(self.sheet.subsurface(clipped).copy())
+        return image, (clipped.x - rect.x, clipped.y - rect.y)
+
+    def prune(self, rects):
+        """Forgets every surface not cut from one of rects"""
+        keep = set(tuple(rect) for rect in rects)
+        self.entries = {key: entry for key, entry in self.entries.items()
+                        if key[0] in keep}
+
+    def clear(self):
+        self.entries = {}
+
+
+class ZoomedSheet:
+    """A spritesheet drawn at zoom levels below 1 that are powers of two or
+    whole zoom levels above 1.
+
+    Zoomed out levels are mipmaps made by halving the level above once and
+    keeping it. Zoomed in, only the part of the sheet in view is scaled up,
+    and that is kept until the view moves or changes zoom.
+    """
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.levels = {1: sheet}
+        self.region = None
+
+    def level(self, zoom):
+        if zoom not in self.levels:
+            bigger = self.level(zoom * 2)
+            w, h = bigger.get_size()
+            size = (max(1, w // 2), max(1, h // 2))
+            try:
+                smaller = pygame.transform.smoothscale(bigger, size)
+            except ValueError:
+                # smoothscale only takes 24 and 32 bit surfaces
+                smaller = pygame.transform.scale(bigger, size)
+            self.levels[zoom] = smaller
+        return self.levels[zoom]
+
+    def draw(self, surface, dest, origin, zoom):
+        """Fills dest on surface with the sheet at zoom, with sheet point
+        origin (floats allowed) at dest's top left"""
+        ox, oy = origin
+        if zoom <= 1:
+            level = self.level(zoom)
+            area = pygame.Rect(math.floor(ox * zoom), math.floor(oy * zoom),
+                               dest.w, dest.h)
+            surface.blit(level, dest, area)
+            return
+        sx, sy = math.floor(ox), math.floor(oy)
+        src = pygame.Rect(sx, sy, math.ceil(dest.w / zoom) + 1,
+                          math.ceil(dest.h / zoom) + 1)
+        src = src.clip(self.sheet.get_rect())
+        if not src:
+            return
+        key = (tuple(src), zoom)
+        if not self.region or self.region[0] != key:
+            scaled = pygame.transform.scale(self.sheet.subsurface(src),
+                                            (src.w * zoom, src.h * zoom))
+            self.region = (key, scaled)
+        scaled = self.region[1]
+        # where the scaled region's top left lands on screen
+        x = dest.x + round((src.x - ox) * zoom)
+        y = dest.y + round((src.y - oy) * zoom)
+        surface.blit(scaled, dest, pygame.Rect(dest.x - x, dest.y - y,
+                                               dest.w, dest.h))
@@ -0,0 +1,181 @@
+"""Undo/redo for the editor.
+
+Every edit is a small command object that knows how to apply and revert
+itself through View's edit primitives. Commands hold only what they
+change: a removed frame keeps an AnimFrame sharing the pose that was
+taken out, a duration change keeps two ints. So history costs bytes
+per step no matter how long the animation is.
+"""
+from collections import deque
+
+# rough bytes per stored command and per rect it holds, for the budget
+COMMAND_COST = 100
+RECT_COST = 50
+
+
+def _frame_cost(frame):
+    return (COMMAND_COST + RECT_COST *
+            (1 + len(frame.hitboxes) + len(frame.damageboxes)))
+
+
+class InsertFrame:
+    def __init__(self, index, frame):
+        self.index = index
+        self.frame = frame
+
+    def do(self, view):
+        view.insert_frame_at(self.index, self.frame)
+
+    def undo(self, view):
+        view.remove_frame_at(self.index)
+
+    def cost(self):
+        return _frame_cost(self.frame)
+
+
+class RemoveFrame:
+    def __init__(self, index):
+        self.index = index
+        self.frame = None
+
+    def do(self, view):
+        self.frame = view.remove_frame_at(self.index)
+
+    def undo(self, view):
+        view.insert_frame_at(self.index, self.frame)
+
+    def cost(self):
+        return _frame_cost(self.frame)
+
+
+class AddBox:
+    def __init__(self, index, kind, rect):
+        self.index = index
+        self.kind = kind
+        self.rect = rect
+
+    def do(self, view):
+        view.add_box_at(self.index, self.kind, self.rect)
+
+    def undo(self, view):
+        view.remove_box_at(self.index, self.kind, -1)
+
+    def cost(self):
+        return COMMAND_COST + RECT_COST
+
+
+class SetBox:
+    """A box moved or resized"""
+    def __init__(self, index, kind, box, old, new):
+        self.index = index
+        self.kind = kind
+        self.box = box
+        self.old = old
+        self.new = new
+
+    def do(self, view):
+        view.set_box_at(self.index, self.kind, self.box, self.new)
+
+    def undo(self, view):
+        view.set_box_at(self.index, self.kind, self.box, self.old)
+
+    def cost(self):
+        return COMMAND_COST + 2 * RECT_COST
+
+
+class SetDuration:
+    def __init__(self, index, old, new):
+        self.index = index
+        self.old = old
+        self.new = new
+
+    def do(self, view):
+        view.set_duration_at(self.index, self.new)
+
+    def undo(self, view):
+        view.set_duration_at(self.index, self.old)
+
+    def merge(self, other):
+        """Typing a duration a digit at a time is still one step"""
+        if isinstance(other, SetDuration) and other.index == self.index:
+            self.new = other.new
+            return True
+        return False
+
+    def cost(self):
+        return COMMAND_COST
+
+
+class Batch:
+    """Several commands undone and redone as one step"""
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    def do(self, view):
+        for command in self.commands:
+            command.do(view)
+
+    def undo(self, view):
+        for command in reversed(self.commands):
+            command.undo(view)
+
+    def cost(self):
+        return COMMAND_COST + sum(c.cost() for c in self.commands)
+
+
+class History:
+    """Bounded undo and redo stacks.
+
+    The oldest steps are forgotten once there are more than limit of them
+    or their estimated size passes budget bytes.
+    """
+    def __init__(self, limit=1000, budget=1024 * 1024):
+        self.limit = limit
+        self.budget = budget
+        self.clear()
+
+    def clear(self):
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.used = 0
+        # only the step pushed last may absorb the next one; after an undo
+        # or redo the top of the stack is a finished step
+        self.mergeable = False
+
+    def push(self, command):
+        """Records a command that has just been applied"""
+        for undone in self.redo_stack:
+            self.used -= undone.cost()
+        self.redo_stack = []
+        last = (self.undo_stack[-1] if self.mergeable and self.undo_stack
+                else None)
+        self.mergeable = True
+        if last and hasattr(last, 'merge'):
+            before = last.cost()
+            if last.merge(command):
+                self.used += last.cost() - before
+                return
+        self.undo_stack.append(command)
+        self.used += command.cost()
+        while self.undo_stack and (len(self.undo_stack) > self.limit or
+                                   self.used > self.budget):
+            self.used -= self.undo_stack.popleft().cost()
+
+    def undo(self, view):
+        """Reverts the last step, returns it or None if there was none"""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self.mergeable = False
+        command.undo(view)
+        self.redo_stack.append(command)
+        return command
+
+    def redo(self, view):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self.mergeable = False
+        command.do(view)
+        self.undo_stack.append(command)
+        return command
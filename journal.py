@@ -0,0 +1,268 @@
+"""Append-only edit journal for crash recovery and background saving.
+
+A journal is a text file of JSON records, one per line. The first record
+names the base: the animation file the edits apply to (or none for a new
+animation) and its spritesheet. Every later record is one edit as the
+editor made it. Replaying the records on top of the base gives back the
+animation as it was at the last edit.
+
+Compaction writes the current animation out to a file on a worker thread,
+then starts a new journal based on that file holding only the edits made
+while it was being written.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+import animation
+from animation import Animation, AnimFrame
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser('~'), '.bones', 'autosave')
+
+
+def frame_record(frame):
+    return {'rect': list(frame.rect),
+            'duration': frame.duration,
+            'hitboxes': [list(box) for box in frame.hitboxes],
+            'damageboxes': [list(box) for box in frame.damageboxes]}
+
+
+def record_frame(record):
+    frame = AnimFrame(pygame.Rect(record['rect']))
+    frame.duration = record['duration']
+    for box in record['hitboxes']:
+        frame.add_hitbox(pygame.Rect(box))
+    for box in record['damageboxes']:
+        frame.add_damagebox(pygame.Rect(box))
+    return frame
+
+
+def apply(anim, record):
+    """Replays one edit record onto anim"""
+    op = record['op']
+    if op == 'insert_frame':
+        anim.insert_frame(record['index'], record_frame(record['frame']))
+    elif op == 'remove_frame':
+        anim.remove_frame(record['index'])
+    elif op == 'add_box':
+        frame = anim.frames[record['frame']]
+        getattr(frame, 'add_' + record['kind'])(pygame.Rect(record['rect']))
+    elif op == 'remove_box':
+        frame = anim.frames[record['frame']]
+        getattr(frame, 'remove_' + record['kind'])(record['index'])
+    elif op == 'set_box':
+        frame = anim.frames[record['frame']]
+        getattr(frame, 'set_' + record['kind'])(record['index'],
+                                                pygame.Rect(record['rect']))
+    elif op == 'set_duration':
+        anim.frames[record['frame']].duration = record['duration']
+        anim.invalidate()
+    else:
+        raise Exception('Unknown journal record %r' % op)
+
+
+def read_records(path):
+    """Returns the journal's records. A torn last line, left by a crash in
+    the middle of a write, is ignored."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def recover(path):
+    """Rebuilds (sheetpath, animation, base) from a journal"""
+    records = read_records(path)
+    if not records or records[0]['op'] != 'base':
+        raise Exception('Not an edit journal: %s' % path)
+    base = records[0]['path']
+    sheetpath = records[0]['sheet']
+    if base:
+        sheet, anim = animation.open_animation(base)
+    else:
+        anim = Animation(None)
+    for record in records[1:]:
+        if record['op'] == 'sheet':
+            sheetpath = record['path']
+        else:
+            apply(anim, record)
+    return (sheetpath, anim, base)
+
+
+def journal_key(docpath):
+    """Names the journals of a document, or of a new one if docpath is None"""
+    if not docpath:
+        return 'untitled'
+    docpath = os.path.abspath(docpath)
+    digest = hashlib.sha1(docpath.encode('utf-8')).hexdigest()[:12]
+    return '%s-%s' % (os.path.basename(docpath), digest)
+
+
+def journal_path(docpath):
+    """A journal for docpath owned by this process"""
+    return os.path.join(AUTOSAVE_DIR, '%s-%d.journal'
+                        % (journal_key(docpath), os.getpid()))
+
+
+def orphaned_journals(docpath, stale):
+    """Journals for docpath that nobody has touched for stale seconds,
+    newest first. Live editors touch theirs more often than that."""
+    if not os.path.isdir(AUTOSAVE_DIR):
+        return []
+    prefix = journal_key(docpath) + '-'
+    now = time.time()
+    found = []
+    for name in os.listdir(AUTOSAVE_DIR):
+        path = os.path.join(AUTOSAVE_DIR, name)
+        if (name.startswith(prefix) and name.endswith('.journal') and
+                name[len(prefix):-len('.journal')].isdigit() and
+                now - os.path.getmtime(path) > stale):
+            found.append(path)
+    found.sort(key=os.path.getmtime, reverse=True)
+    return found
+
+
+def snapshot_path(path):
+    """Where autosave compaction of the journal at path writes to"""
+    return os.path.splitext(path)[0] + animation.BINARY_EXT
+
+
+def discard_journal(path):
+    """Deletes a journal and the autosave snapshot it was based on"""
+    records = read_records(path)
+    os.remove(path)
+    base = records[0].get('path') if records else None
+    if base and _autosaved(base) and os.path.exists(base):
+        os.remove(base)
+
+
+def _autosaved(path):
+    """True for snapshots that compaction wrote into AUTOSAVE_DIR"""
+    folder = os.path.dirname(os.path.abspath(path))
+    return folder == os.path.abspath(AUTOSAVE_DIR)
+
+
+def _write_file(path, data):
+    """Atomically replaces path with data, which is bytes, a str or a
+    function that writes text to the file it is given"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb' if isinstance(data, bytes) else 'w') as f:
+        if callable(data):
+            data(f)
+        else:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class EditJournal:
+    """Journal the editor appends to as edits happen.
+
+    Records are flushed as they are written so they survive the editor
+    crashing; fsync also forces them to disk to survive the machine
+    crashing, at the cost of a sync per edit.
+    """
+    def __init__(self, path, base=None, sheetpath='', pending=(),
+                 fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        # records dropped from the front of pending by compaction, so a
+        # record's position counted from the start of the session stays
+        # put while earlier compactions finish
+        self.trimmed = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            self._start(path, base, sheetpath, pending)
+
+    @classmethod
+    def adopt(cls, orphan, path, fsync=False):
+        """Takes over the records of an orphaned journal under path"""
+        records = read_records(orphan)
+        header = records[0]
+        journal = cls(path, header['path'], header['sheet'], records[1:],
+                      fsync)
+        os.remove(orphan)
+        return journal
+
+    def _start(self, path, base, sheetpath, pending):
+        """Writes a fresh journal at path and appends to it from now on"""
+        self.base = base
+        self.sheetpath = sheetpath
+        self.pending = list(pending)
+        for record in self.pending:
+            if record['op'] == 'sheet':
+                self.sheetpath = record['path']
+        header = {'op': 'base', 'path': base, 'sheet': sheetpath}
+        lines = [json.dumps(r) + '\n' for r in [header] + self.pending]
+        _write_file(path, ''.join(lines))
+        self.file = open(path, 'a')
+
+    def record(self, op, **fields):
+        fields['op'] = op
+        line = json.dumps(fields) + '\n'
+        with self.lock:
+            if op == 'sheet':
+                self.sheetpath = fields['path']
+            self.pending.append(fields)
+            self.file.write(line)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def touch(self):
+        """Marks the journal as belonging to a live editor"""
+        os.utime(self.path)
+
+    def compact(self, anim, target=None, path=None):
+        """Writes anim to target on the worker thread and rebases the journal
+        onto it, moving it to path if given. target defaults to this
+        journal's autosave snapshot and picks binary or XML from its
+        extension. Returns a Future."""
+        target = target or snapshot_path(self.path)
+        path = path or self.path
+        # pack the snapshot here so later edits can't race with the writer
+        with self.lock:
+            data = animation.save_animation_binary(anim, self.sheetpath,
+                                                   target)
+            done = self.trimmed + len(self.pending)
+        return self.worker.submit(self._compact, data, target, path, done)
+
+    def _compact(self, data, target, path, done):
+        if target.endswith(animation.BINARY_EXT):
+            _write_file(target, data)
+        else:
+            sheetpath, anim = animation.load_animation_binary(io.BytesIO(data))
+            _write_file(target, lambda f: animation.write_animation_xml(
+                anim, sheetpath, f))
+        with self.lock:
+            old_path, old_base = self.path, self.base
+            self.file.close()
+            self.path = path
+            self._start(path, target, self.sheetpath,
+                        self.pending[done - self.trimmed:])
+            self.trimmed = done
+            if old_path != path:
+                os.remove(old_path)
+            if old_base and old_base != target and _autosaved(old_base):
+                os.remove(old_base)
+
+    def close(self):
+        self.worker.shutdown(wait=True)
+        with self.lock:
+            self.file.close()
+
+    def discard(self):
+        """Closes the journal and deletes it"""
+        self.close()
+        discard_journal(self.path)
@@ -0,0 +1,151 @@
+"""Loading sheets and animations on worker threads.
+
+Decoding a big PNG or parsing a long XML animation takes long enough to
+freeze the editor if it happens in a Tk callback. Loader runs them on a
+small thread pool instead. Results come back through a queue that the
+UI thread drains with poll, so everything that touches the display or
+the views still happens on the UI thread.
+
+Each load goes in a named slot, and starting a new load in a slot
+cancels the one already there: opening another file while a sheet is
+still decoding drops the old sheet rather than showing it late.
+"""
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import animation
+
+LOAD_WORKERS = 2
+
+
+class Cancelled(Exception):
+    pass
+
+
+class LoadRequest:
+    """One load in flight. progress is a fraction, or None while the load
+    can't tell how far along it is."""
+    def __init__(self, slot, path, done, failed):
+        self.slot = slot
+        self.path = path
+        self.done = done
+        self.failed = failed
+        self.progress = None
+        self.cancelled = False
+        self.future = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future:
+            self.future.cancel()
+
+    def check(self):
+        """Stops the worker if the load has been cancelled"""
+        if self.cancelled:
+            raise Cancelled()
+
+
+class ProgressReader:
+    """A file wrapper that reports how much of the file has been read and
+    stops reading once its request is cancelled"""
+    def __init__(self, f, request):
+        self.f = f
+        self.request = request
+        self.size = max(1, os.fstat(f.fileno()).st_size)
+
+    def read(self, size=-1):
+        self.request.check()
+        data = self.f.read(size)
+        self.request.progress = self.f.tell() / self.size
+        return data
+
+
+def read_animation(path, request):
+    """Opens an animation file in either format, returning (sheetpath,
+    animation)"""
+    with open(path, 'rb') as f:
+        binary = f.read(len(animation.BINARY_MAGIC)) == animation.BINARY_MAGIC
+        f.seek(0)
+        source = ProgressReader(f, request)
+        if binary:
+            return animation.load_animation_binary(source)
+        return animation.load_animation(source)
+
+
+def decode_sheet(cache):
+    """A task decoding a sheet through cache, returning (mtime, decoded);
+    cache.finish makes it ready to draw on the UI thread"""
+    def task(path, request):
+        mtime = os.path.getmtime(os.path.abspath(path))
+        decoded = cache.decode(path)
+        request.check()
+        return mtime, decoded
+    return task
+
+
+class Loader:
+    def __init__(self, workers=LOAD_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix='load')
+        self.finished = queue.SimpleQueue()
+        self.slots = {}
+
+    def submit(self, slot, task, path, done, failed=None):
+        """Runs task(path, request) on a worker and calls done(result), or
+        failed(error), from poll once it finishes. Cancels whatever was
+        loading in slot, unless that was the same path, which is left to
+        finish and handed to done instead."""
+        old = self.slots.get(slot)
+        if old and not old.cancelled:
+            if old.path == path:
+                old.done, old.failed = done, failed
+                return old
+            old.cancel()
+        request = LoadRequest(slot, path, done, failed)
+        self.slots[slot] = request
+        request.future = self.pool.submit(self._run, request, task)
+        return request
+
+    def _run(self, request, task):
+        try:
+            result = task(request.path, request)
+            error = None
+        except Exception as e:
+            result, error = None, e
+        self.finished.put((request, result, error))
+
+    def poll(self):
+        """Hands finished loads to their callbacks. Call it from the UI
+        thread. Returns True if anything finished."""
+        any_done = False
+        while True:
+            try:
+                request, result, error = self.finished.get_nowait()
+            except queue.Empty:
+                return any_done
+            if self.slots.get(request.slot) is request:
+                del self.slots[request.slot]
+            if request.cancelled or isinstance(error, Cancelled):
+                continue
+            any_done = True
+            if error is None:
+                request.done(result)
+            elif request.failed:
+                request.failed(error)
+            else:
+                raise error
+
+    def pending(self):
+        """The loads still in flight"""
+        return list(self.slots.values())
+
+    def cancel(self, slot=None):
+        """Cancels the load in slot, or every load"""
+        for name, request in list(self.slots.items()):
+            if slot is None or name == slot:
+                request.cancel()
+                del self.slots[name]
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+"""Multi-frame previews: onion skin layers and a filmstrip of every frame.
+
+Both are drawn from composite surfaces that are only touched when a frame
+in them changes. A frame counts as changed when its rect or boxes do, and
+a frame's own layer (its image with the boxes drawn on) is cached by that
+content, so an edit rebuilds one layer and leaves the rest alone. Showing
+eight onion layers costs one blit per redraw, the same as showing none.
+"""
+import math
+import pygame
+from animation import pose_key
+
+HITBOX_COLOR = (0, 0, 255)
+DAMAGEBOX_COLOR = (255, 0, 0)
+# alpha of the nearest onion layer, farther ones fade out from it
+ONION_ALPHA = 128
+
+
+def zoom_rect(rect, zoom):
+    """rect in frame coords scaled about the frame's top left"""
+    x0, y0 = round(rect[0] * zoom), round(rect[1] * zoom)
+    x1 = round((rect[0] + rect[2]) * zoom)
+    y1 = round((rect[1] + rect[3]) * zoom)
+    return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+
+
+class FrameLayers:
+    """Frames drawn with their boxes, cached by content, zoom and alpha"""
+    def __init__(self, surfaces):
+        self.surfaces = surfaces
+        self.layers = {}
+
+    def get(self, frame, zoom=1, alpha=255):
+        """Returns (surface, offset) with offset from the frame's top left"""
+        key = (pose_key(frame), zoom, alpha)
+        layer = self.layers.get(key)
+        if layer is None:
+            layer = self.layers[key] = self._build(frame, zoom, alpha)
+        return layer
+
+    def _build(self, frame, zoom, alpha):
+        entry = self.surfaces.get(frame.rect, scale=zoom)
+        boxes = [(zoom_rect(box, zoom), HITBOX_COLOR)
+                 for box in frame.hitboxes]
+        boxes += [(zoom_rect(box, zoom), DAMAGEBOX_COLOR)
+                  for box in frame.damageboxes]
+        for box, color in boxes:
+            box.normalize()
+        bounds = pygame.Rect(0, 0, round(frame.rect.w * zoom),
+                             round(frame.rect.h * zoom))
+        bounds.unionall_ip([box for box, color in boxes] or [bounds])
+        layer = pygame.Surface((max(1, bounds.w), max(1, bounds.h)),
+                               pygame.SRCALPHA, 32)
+        layer.fill((0, 0, 0, 0))
+        if entry:
+            image, (dx, dy) = entry
+            layer.blit(image, (dx - bounds.x, dy - bounds.y))
+        for box, color in boxes:
+            pygame.draw.rect(layer, color, box.move(-bounds.x, -bounds.y), 1)
+        if alpha < 255:
+            layer.fill((255, 255, 255, alpha),
+                       special_flags=pygame.BLEND_RGBA_MULT)
+        return layer, bounds.topleft
+
+    def prune(self, frames):
+        """Forgets the layers of frames that no longer look that way"""
+        keep = set(pose_key(frame) for frame in frames)
+        self.layers = {key: layer for key, layer in self.layers.items()
+                       if key[0] in keep}
+
+
+class OnionSkin:
+    """The frames around a frame overlaid at falling alpha"""
+    def __init__(self, layers):
+        self.layers = layers
+        self.key = None
+        self.composite = None
+
+    def render(self, frames, index, count, zoom=1):
+        """Returns (surface, offset) of the count frames either side of
+        index, offset from the frame's top left, or None if there are
+        none"""
+        picks = []
+        for distance in range(count, 0, -1):
+            for i in (index - distance, index + distance):
+                if 0 <= i < len(frames) and i != index:
+                    picks.append((frames[i], distance))
+        key = (tuple((pose_key(frame), d) for frame, d in picks), count,
+               zoom)
+        if key == self.key:
+            return self.composite
+        self.key = key
+        if not picks:
+            self.composite = None
+            return None
+        # farthest first so nearer frames end up on top
+        layers = []
+        for frame, distance in picks:
+            alpha = ONION_ALPHA * (count - distance + 1) // count
+            layers.append(self.layers.get(frame, zoom, alpha))
+        bounds = pygame.Rect(layers[0][1], layers[0][0].get_size())
+        for layer, offset in layers[1:]:
+            bounds.union_ip(pygame.Rect(offset, layer.get_size()))
+        composite = pygame.Surface(bounds.size, pygame.SRCALPHA, 32)
+        composite.fill((0, 0, 0, 0))
+        composite.blits([(layer, (x - bounds.x, y - bounds.y))
+                         for layer, (x, y) in layers], doreturn=False)
+        self.composite = (composite, bounds.topleft)
+        return self.composite
+
+
+class Filmstrip:
+    """Every frame as a thumbnail in a grid of cell sized squares"""
+    def __init__(self, layers, cell=64, gap=4):
+        self.layers = layers
+        self.cell = cell
+        self.gap = gap
+        self.surface = None
+        self.columns = 0
+        self.keys = []
+        self.thumbnails = {}
+
+    def cell_rect(self, index):
+        step = self.cell + self.gap
+        row, col = divmod(index, self.columns)
+        return pygame.Rect(self.gap + col * step, self.gap + row * step,
+                           self.cell, self.cell)
+
+    def index_at(self, pos):
+        """The frame whose cell holds pos (in strip coords), or None"""
+        step = self.cell + self.gap
+        col, row = (pos[0] - self.gap) // step, (pos[1] - self.gap) // step
+        if not 0 <= col < self.columns or row < 0:
+            return None
+        index = row * self.columns + col
+        if index < len(self.keys) and self.cell_rect(index).collidepoint(pos):
+            return index
+        return None
+
+    def thumbnail(self, frame, key):
+        thumb = self.thumbnails.get(key)
+        if thumb is None:
+            layer, offset = self.layers.get(frame)
+            w, h = layer.get_size()
+            scale = min(1, self.cell / max(w, h))
+            size = (max(1, math.floor(w * scale)), max(1, math.floor(h * scale)))
+            thumb = pygame.transform.smoothscale(layer, size) \
+                if scale < 1 else layer
+            self.thumbnails[key] = thumb
+        return thumb
+
+    def render(self, frames, width):
+        """Returns the strip laid out to fit width, repainting only the
+        cells whose frame changed since the last call"""
+        columns = max(1, (width - self.gap) // (self.cell + self.gap))
+        rows = max(1, math.ceil(len(frames) / columns))
+        size = (self.gap + columns * (self.cell + self.gap),
+                self.gap + rows * (self.cell + self.gap))
+        if not self.surface or columns != self.columns or \
+                self.surface.get_size() != size:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+            self.surface.fill((0, 0, 0, 0))
+            self.columns = columns
+            self.keys = []
+        keys = [pose_key(frame) for frame in frames]
+        for i in range(max(len(keys), len(self.keys))):
+            old = self.keys[i] if i < len(self.keys) else None
+            new = keys[i] if i < len(keys) else None
+            if old == new:
+                continue
+            cell = self.cell_rect(i)
+            self.surface.fill((0, 0, 0, 0), cell)
+            if new is not None:
+                thumb = self.thumbnail(frames[i], new)
+                self.surface.blit(thumb, thumb.get_rect(center=cell.center))
+        self.keys = keys
+        if len(self.thumbnails) > 2 * len(keys) + 16:
+            live = set(keys)
+            self.thumbnails = {key: thumb for key, thumb
+                               in self.thumbnails.items() if key in live}
+        if len(self.layers.layers) > 2 * len(keys) + 16:
+            # the layers the thumbnails were scaled from go the same way
+            self.layers.prune(frames)
+            self.layers.surfaces.prune(frame.rect for frame in frames)
+        return self.surface
@@ -0,0 +1,125 @@
+"""Frame time instrumentation for the editor.
+
+Profiler times named phases of each frame. The last few hundred timings
+of every phase are kept in a ring buffer for rolling percentiles, which
+the overlay shows on screen, and every timing also goes into a bounded
+trace that dump_trace writes out in the Chrome trace event format, so it
+opens in chrome://tracing, Perfetto or speedscope.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy
+import pygame
+
+TRACE_DIR = os.path.join(os.path.expanduser('~'), '.bones', 'traces')
+
+
+class Ring:
+    """The last size samples of one phase, in ms"""
+    def __init__(self, size):
+        self.values = numpy.zeros(size)
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def samples(self):
+        return self.values[:min(self.count, len(self.values))]
+
+    def percentiles(self, qs=(50, 95, 99)):
+        samples = self.samples()
+        if not samples.size:
+            return [0.0] * len(qs)
+        return numpy.percentile(samples, qs).tolist()
+
+
+class Profiler:
+    """Times phases, keeping size samples of each and up to trace_size
+    trace events"""
+    def __init__(self, size=300, trace_size=200000):
+        self.size = size
+        self.rings = {}
+        self.order = []
+        self.trace = deque(maxlen=trace_size)
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.overlay = False
+        self.overlay_rect = None
+
+    @contextmanager
+    def phase(self, name):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, began, time.perf_counter())
+
+    def record(self, name, began, ended):
+        """Adds a phase that ran from began to ended (perf_counter times)"""
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = self.rings[name] = Ring(self.size)
+            self.order.append(name)
+        ring.add((ended - began) * 1000)
+        self.trace.append((name, began, ended, threading.get_ident()))
+
+    def percentiles(self, name, qs=(50, 95, 99)):
+        ring = self.rings.get(name)
+        return ring.percentiles(qs) if ring else [0.0] * len(qs)
+
+    def summary(self):
+        """{phase: {'p50', 'p95', 'p99', 'count'}} in ms"""
+        stats = {}
+        for name in self.order:
+            p50, p95, p99 = self.rings[name].percentiles()
+            stats[name] = {'p50': p50, 'p95': p95, 'p99': p99,
+                           'count': self.rings[name].count}
+        return stats
+
+    def draw_overlay(self, surface, font):
+        """Draws a table of phase percentiles in the top right corner and
+        returns the area it covered"""
+        lines = ['%-24s %6s %6s %6s' % ('ms', 'p50', 'p95', 'p99')]
+        for name in self.order:
+            p50, p95, p99 = self.rings[name].percentiles()
+            lines.append('%-24s %6.2f %6.2f %6.2f'
+                         % (name[:24], p50, p95, p99))
+        rendered = [font.render(line, True, (255, 255, 0)) for line in lines]
+        width = max(text.get_width() for text in rendered) + 8
+        height = sum(text.get_height() for text in rendered) + 8
+        area = pygame.Rect(0, 0, width, height)
+        area.topright = surface.get_rect().topright
+        surface.fill((0, 0, 0), area)
+        y = area.y + 4
+        for text in rendered:
+            surface.blit(text, (area.x + 4, y))
+            y += text.get_height()
+        self.overlay_rect = area
+        return area
+
+    def trace_events(self):
+        events = []
+        for name, began, ended, tid in self.trace:
+            events.append({'name': name, 'ph': 'X', 'pid': self.pid,
+                           'tid': tid,
+                           'ts': (began - self.start) * 1e6,
+                           'dur': (ended - began) * 1e6})
+        return events
+
+    def dump_trace(self, path=None):
+        """Writes the trace to path, by default a new file in TRACE_DIR.
+        Returns the path."""
+        if path is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, time.strftime(
+                'trace-%Y%m%d-%H%M%S.json'))
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms',
+                       'otherData': {'summary': self.summary()}}, f)
+        return path
@@ -0,0 +1,167 @@
+"""Projects: many named animations and the spritesheets they use in one file.
+
+A character's idle, walk and attack animations usually share a sheet. In
+a project the sheet is named once in a table and each animation points
+at it by number, and an index at the head of the file says where every
+animation's bytes are, so opening one reads the index and that animation
+and nothing else.
+"""
+import io
+import json
+import os
+import struct
+from collections import OrderedDict
+import animation
+
+# Project files: magic, version, flags and the index length, then the
+# index as utf-8 JSON padded to 4 bytes, then every animation in the
+# binary animation format. The index holds the sheet paths, relative to
+# the project file, and for each animation its name, sheet number, frame
+# count and the offset (from the end of the index) and size of its bytes.
+PROJECT_EXT = '.bproj'
+PROJECT_MAGIC = b'BPRJ'
+PROJECT_VERSION = 1
+_HEADER = struct.Struct('<4sHHI')
+
+
+def _read_index(f):
+    magic, version, flags, length = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != PROJECT_MAGIC:
+        raise Exception('Not a project file')
+    if version > PROJECT_VERSION:
+        raise Exception('Unsupported project version %d' % version)
+    index = json.loads(f.read(length).decode('utf-8'))
+    return index, _HEADER.size + length + (-length % 4)
+
+
+class Project:
+    """Named animations over a shared table of spritesheets.
+
+    Opening a project only reads its index. An animation is read the first
+    time it is asked for and kept from then on, so edits made to it are
+    what gets saved; animations that were never asked for are copied
+    across byte for byte.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        # absolute sheet paths
+        self.sheets = []
+        # name -> {'sheet', 'frames', 'offset', 'size'}
+        self.entries = OrderedDict()
+        self.loaded = {}
+        self.data_offset = 0
+        # animations added or removed since the project was opened or saved
+        self.modified = False
+
+    @classmethod
+    def open(cls, path):
+        project = cls(path)
+        with open(path, 'rb') as f:
+            index, project.data_offset = _read_index(f)
+        folder = os.path.dirname(os.path.abspath(path))
+        project.sheets = [os.path.normpath(os.path.join(folder, sheet))
+                          if sheet else '' for sheet in index['sheets']]
+        for entry in index['animations']:
+            project.entries[entry.pop('name')] = entry
+        return project
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def names(self):
+        return list(self.entries)
+
+    def sheet_path(self, name):
+        """Absolute path of the sheet the named animation uses"""
+        return self.sheets[self.entries[name]['sheet']]
+
+    def load(self, name):
+        """The named animation, read from the file on first use"""
+        anim = self.loaded.get(name)
+        if anim is None:
+            entry = self.entries[name]
+            with open(self.path, 'rb') as f:
+                f.seek(self.data_offset + entry['offset'])
+                data = f.read(entry['size'])
+            sheet, anim = animation.load_animation_binary(io.BytesIO(data))
+            self.loaded[name] = anim
+        return anim
+
+    def add(self, name, anim, sheetpath):
+        """Adds an animation, or replaces the one called name"""
+        sheetpath = os.path.abspath(sheetpath) if sheetpath else ''
+        if sheetpath not in self.sheets:
+            self.sheets.append(sheetpath)
+        self.entries[name] = {'sheet': self.sheets.index(sheetpath),
+                              'frames': len(anim.frames)}
+        self.loaded[name] = anim
+        self.modified = True
+
+    def remove(self, name):
+        del self.entries[name]
+        self.loaded.pop(name, None)
+        self.modified = True
+
+    def save(self, path=None):
+        """Writes the project to path, by default where it came from"""
+        path = path or self.path
+        if not path:
+            raise Exception('Project has no path')
+        folder = os.path.dirname(os.path.abspath(path))
+        used = OrderedDict()
+        records, blobs = [], []
+        offset = 0
+        source = open(self.path, 'rb') if self.path else None
+        try:
+            for name, entry in self.entries.items():
+                sheet = self.sheets[entry['sheet']]
+                used.setdefault(sheet, len(used))
+                anim = self.loaded.get(name)
+                if anim is not None:
+                    # sheets live in the table, not in each animation
+                    blob = animation.save_animation_binary(anim, '', path)
+                    frames = len(anim.frames)
+                else:
+                    source.seek(self.data_offset + entry['offset'])
+                    blob = source.read(entry['size'])
+                    frames = entry['frames']
+                records.append({'name': name, 'sheet': used[sheet],
+                                'frames': frames, 'offset': offset,
+                                'size': len(blob)})
+                blobs.append(blob)
+                offset += len(blob)
+        finally:
+            if source:
+                source.close()
+        index = json.dumps({'sheets': [self._relative(sheet, folder)
+                                       for sheet in used],
+                            'animations': records}).encode('utf-8')
+        header = _HEADER.pack(PROJECT_MAGIC, PROJECT_VERSION, 0, len(index))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            f.write(index + b' ' * (-len(index) % 4))
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp, path)
+
+        self.path = path
+        self.sheets = list(used)
+        self.data_offset = _HEADER.size + len(index) + (-len(index) % 4)
+        for record in records:
+            name = record.pop('name')
+            self.entries[name] = record
+        self.modified = False
+
+    @staticmethod
+    def _relative(sheet, folder):
+        if not sheet:
+            return ''
+        try:
+            return os.path.relpath(sheet, folder)
+        except ValueError:
+            # another drive on Windows
+            return sheet
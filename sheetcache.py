@@ -0,0 +1,92 @@
+import os
+from collections import OrderedDict
+import pygame
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+
+def convert_sheet(surface):
+    """Converts a freshly loaded sheet to the display's pixel format so
+    blits from it don't convert every pixel. Left alone when there is no
+    display, e.g. in batch tools."""
+    if pygame.display.get_surface() is None:
+        return surface
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+    return surface.convert()
+
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class SheetCache:
+    """Spritesheets keyed by path and modification time.
+
+    Every caller asking for the same unchanged file gets the same converted
+    Surface. Once the cached sheets take more than budget bytes the least
+    recently used ones are dropped; surfaces still held elsewhere stay
+    valid, they just get loaded again next time.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.sheets = OrderedDict()
+        self.used = 0
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        surface = self.cached(path)
+        if surface is None:
+            mtime = os.path.getmtime(path)
+            surface = self.open(path)
+            self.store(path, mtime, surface)
+        return surface
+
+    def cached(self, path):
+        """The cached sheet for path if the file hasn't changed, else None"""
+        path = os.path.abspath(path)
+        entry = self.sheets.get(path)
+        if entry and entry[0] == os.path.getmtime(path):
+            self.sheets.move_to_end(path)
+            return entry[1]
+        return None
+
+    def open(self, path):
+        """Loads the sheet at path, for when it isn't cached"""
+        return self.finish(self.decode(path))
+
+    def decode(self, path):
+        """The slow half of open. It doesn't touch the display, so it can
+        run on a worker thread."""
+        return pygame.image.load(path)
+
+    def finish(self, decoded):
+        """The other half of open, for the thread that owns the display"""
+        if isinstance(decoded, pygame.Surface):
+            return convert_sheet(decoded)
+        return decoded
+
+    def size_of(self, surface):
+        """Bytes a cached sheet counts against the budget"""
+        return surface_bytes(surface)
+
+    def store(self, path, mtime, surface):
+        self.discard(path)
+        self.sheets[path] = (mtime, surface)
+        self.used += self.size_of(surface)
+        self.evict()
+
+    def discard(self, path):
+        entry = self.sheets.pop(os.path.abspath(path), None)
+        if entry:
+            self.used -= self.size_of(entry[1])
+
+    def evict(self):
+        # never evict the sheet that was just added
+        while self.used > self.budget and len(self.sheets) > 1:
+            path, (mtime, surface) = self.sheets.popitem(last=False)
+            self.used -= self.size_of(surface)
+
+    def clear(self):
+        self.sheets.clear()
+        self.used = 0
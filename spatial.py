@@ -0,0 +1,75 @@
+"""A uniform grid over rects for answering "what is under this point".
+
+Every rect is filed under each grid cell it overlaps, so a point query
+only looks at the few rects sharing its cell instead of all of them.
+Frames on a sheet and boxes in a frame are laid out roughly on a grid
+of their own, which keeps cells short even with thousands of rects.
+"""
+import pygame
+
+CELL_SIZE = 64
+
+
+class GridIndex:
+    """Rects filed by key in square cells of cell_size"""
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.clear()
+
+    def clear(self):
+        self.rects = {}
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def _cells(self, rect):
+        size = self.cell_size
+        for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                yield cx, cy
+
+    def insert(self, key, rect):
+        """Files rect under key, replacing whatever key had before"""
+        if key in self.rects:
+            self.remove(key)
+        rect = pygame.Rect(rect)
+        rect.normalize()
+        self.rects[key] = rect
+        for cell in self._cells(rect):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key)
+        for cell in self._cells(rect):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def at(self, pos):
+        """Keys whose rect contains pos"""
+        size = self.cell_size
+        keys = self.cells.get((pos[0] // size, pos[1] // size), ())
+        return [key for key in keys if self.rects[key].collidepoint(pos)]
+
+    def query(self, rect):
+        """Keys whose rect overlaps rect"""
+        rect = pygame.Rect(rect)
+        rect.normalize()
+        found = set()
+        for cell in self._cells(rect):
+            found.update(self.cells.get(cell, ()))
+        return [key for key in found if self.rects[key].colliderect(rect)]
+
+    def pick(self, pos):
+        """The key with the smallest rect under pos, or None. Inner boxes
+        win over the boxes around them."""
+        keys = self.at(pos)
+        if not keys:
+            return None
+        return min(keys, key=lambda key: (self.rects[key].w *
+                                          self.rects[key].h, key))
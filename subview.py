@@ -1,20 +1,63 @@
 import pygame
 import copy
-from animation import Animation, AnimFrame
+import math
+import time
+from animation import Animation, AnimFrame, pose_key
+from framecache import FrameSurfaceCache, ZoomedSheet
+from preview import FrameLayers, OnionSkin, Filmstrip
+from spatial import GridIndex
+from tiledsheet import TiledSheet
+from trim import trim_rect
 
 class SubView:
+    # Zoomed out levels are powers of two so they can be mipmaps, zoomed
+    # in levels are whole so every sheet pixel stays a square
+    ZOOM_LEVELS = (0.125, 0.25, 0.5, 1, 2, 3, 4, 6, 8, 12, 16)
+
     def __init__(self, parent, rect_coords, title):
         self.view_rect = pygame.Rect(rect_coords)
+        self.name = title
         self.title_text = parent.font.render(title, True, (255, 255, 255))
+        self.profiler = parent.profiler
         self.camera = copy.deepcopy(self.view_rect)
         self.scroll_anchor = (None, None)
         self.spritesheet = None
+        self.dirty_rects = [self.view_rect.copy()]
+        self.zoom = 1
+
+    def invalidate(self, rect=None):
+        """Marks rect, or the whole view, as needing a redraw"""
+        if rect is None:
+            rect = self.view_rect
+        rect = pygame.Rect(rect)
+        rect.normalize()
+        rect = rect.clip(self.view_rect)
+        if rect.w and rect.h:
+            self.dirty_rects.append(rect)
+
+    def invalidate_box(self, rect):
+        """Marks an outlined box as needing a redraw"""
+        rect = pygame.Rect(rect)
+        rect.normalize()
+        self.invalidate(rect.inflate(2, 2))
+
+    def take_dirty(self):
+        """Returns the area needing a redraw, or None, and clears it"""
+        if not self.dirty_rects:
+            return None
+        dirty = self.dirty_rects[0].unionall(self.dirty_rects[1:])
+        self.dirty_rects = []
+        return dirty
 
     def handle_event(self, event):
         # Set anchor point for scrolling
         if event.type == pygame.MOUSEBUTTONDOWN:
             if event.button == 3:
                 self.scroll_anchor = pygame.mouse.get_pos()
+        elif event.type == pygame.MOUSEWHEEL:
+            pos = pygame.mouse.get_pos()
+            if self.view_rect.collidepoint(pos) and event.y:
+                self.zoom_at(pos, self.next_zoom(event.y))
 
     def tick(self):
         # Scroll camera by delta mouse position
@@ -24,7 +67,30 @@ class SubView:
             anchx, anchy = self.scroll_anchor
             dx, dy = anchx - x, anchy - y
             self.scroll_anchor = (x, y)
-            self.camera.move_ip(dx, dy)
+            if dx or dy:
+                self.pan(dx, dy)
+
+    def pan(self, dx, dy):
+        """Moves the camera by dx, dy screen pixels"""
+        self.camera.move_ip(dx, dy)
+        self.invalidate()
+
+    def next_zoom(self, steps):
+        """The zoom level steps levels in from the current one"""
+        levels = self.ZOOM_LEVELS
+        index = levels.index(self.zoom) if self.zoom in levels else \
+            levels.index(1)
+        index = min(max(index + steps, 0), len(levels) - 1)
+        return levels[index]
+
+    def zoom_at(self, pos, zoom):
+        """Zooms keeping what is under screen point pos in place. Views
+        that can't zoom ignore it."""
+        pass
+
+    def is_dragging(self):
+        valid_anchor = (None not in self.scroll_anchor)
+        return pygame.mouse.get_pressed()[2] and valid_anchor
 
     def draw(self, surface):
         pygame.draw.rect(surface, (255,255,255), self.view_rect, 1)
@@ -32,24 +98,41 @@ class SubView:
                                        50, 32))
 
     def reset(self):
-        pass
+        self.invalidate()
 
 class SpritesheetSubView(SubView):
     def __init__(self, parent, rect_coords):
         super().__init__(parent, rect_coords, 'Spritesheet View')
-        self.select_rect = pygame.Rect(0,0,0,0)
+        # the selection in sheet coords, or None; kept on the sheet so
+        # zooming and panning can't round it off by a pixel
+        self.select_rect = None
+        # the box being dragged out, in screen coords
+        self.drag_rect = pygame.Rect(0,0,0,0)
         self.has_clicked = False
+        # sheet point at the view's top left, kept apart from the integer
+        # camera so panning while zoomed in doesn't lose fractions
+        self.origin = [float(self.camera.x), float(self.camera.y)]
+        self.zoomed = None
+        # frame rects on the sheet, indexed the first time one is picked
+        # after they change
+        self.frames = None
+        self.frame_index = GridIndex()
+        self.index_stale = True
+        self.picked = None
 
     def handle_event(self, event):
         super().handle_event(event)
+        old_outline = self.outline()
         if event.type == pygame.MOUSEBUTTONDOWN:
             in_bounds = self.view_rect.collidepoint(pygame.mouse.get_pos())
             # Start selection box
             if event.button == 1 and in_bounds:
                 self.has_clicked = True
-                self.select_rect.x, self.select_rect.y = pygame.mouse.get_pos()
-            else:
-                self.select_rect = pygame.Rect(0,0,0,0)
+                self.select_rect = None
+                self.drag_rect = pygame.Rect(pygame.mouse.get_pos(), (0, 0))
+            elif event.button not in (4, 5):
+                # wheel clicks zoom instead
+                self.select_rect = None
 
         elif event.type == pygame.MOUSEBUTTONUP:
             # Complete selection box            
@@ -57,123 +140,178 @@ class SpritesheetSubView(SubView):
                 self.has_clicked = False
                 # restrict rect to spritesheet's bounds
                 mx, my = pygame.mouse.get_pos()
-                select_start = (self.select_rect.x, self.select_rect.y)
+                select = self.drag_rect.copy()
+                select.normalize()
+                self.drag_rect = pygame.Rect(0,0,0,0)
+                clip = self.cam_to_sheet(select)
                 sheet_rect = self.spritesheet.get_rect()
-                # clip won't work if top left of select_rect is out of bounds
-                if not sheet_rect.collidepoint(select_start):
-                    self.select_rect = pygame.Rect(0,0,0,0)
-                else:
-                    clip = self.select_rect.clip(sheet_rect)
-                    if clip:
-                        clip.normalize()
-                        clip = self.cam_to_sheet(clip)
-                        self.select_rect = self.shrink_frame(self.spritesheet, clip)
-                        if not self.select_rect:
-                            self.select_rect = pygame.Rect(0,0,0,0)
+                if not clip:
+                    # a click without a drag picks the frame under it
+                    self.pick_frame((mx, my))
+                # clip won't work if top left of the drag is out of bounds
+                elif sheet_rect.collidepoint(clip.topleft):
+                    clip = clip.clip(sheet_rect)
+                    self.select_rect = self.shrink_frame(self.spritesheet, clip)
+        self.selection_changed(old_outline)
 
     def tick(self):
         super().tick()
-        # Update select_rect size
+        # Update drag_rect size
         if pygame.mouse.get_pressed()[0] and self.has_clicked:
+            old_outline = self.outline()
             mx, my = pygame.mouse.get_pos()
-            self.select_rect.w = mx - self.select_rect.x
-            self.select_rect.h = my - self.select_rect.y
+            self.drag_rect.w = mx - self.drag_rect.x
+            self.drag_rect.h = my - self.drag_rect.y
+            self.selection_changed(old_outline)
+
+    def outline(self):
+        """The box drawn for the selection, in screen coords"""
+        if self.has_clicked:
+            return self.drag_rect.copy()
+        if self.select_rect:
+            return self.sheet_to_cam(self.select_rect)
+        return pygame.Rect(0,0,0,0)
+
+    def selection_changed(self, old_outline):
+        outline = self.outline()
+        if outline != old_outline:
+            self.invalidate_box(old_outline)
+            self.invalidate_box(outline)
+
+    def is_dragging(self):
+        selecting = pygame.mouse.get_pressed()[0] and self.has_clicked
+        return selecting or super().is_dragging()
+
+    def pan(self, dx, dy):
+        self.origin[0] += dx / self.zoom
+        self.origin[1] += dy / self.zoom
+        self.sync_camera()
+        self.invalidate()
+
+    def zoom_at(self, pos, zoom):
+        if zoom == self.zoom:
+            return
+        px, py = pos[0] - self.view_rect.x, pos[1] - self.view_rect.y
+        self.origin[0] += px / self.zoom - px / zoom
+        self.origin[1] += py / self.zoom - py / zoom
+        self.zoom = zoom
+        self.sync_camera()
+        self.invalidate()
+
+    def sync_camera(self):
+        """Points camera at the part of the sheet in view"""
+        self.camera = pygame.Rect(math.floor(self.origin[0]),
+                                  math.floor(self.origin[1]),
+                                  math.ceil(self.view_rect.w / self.zoom),
+                                  math.ceil(self.view_rect.h / self.zoom))
 
     def draw(self, surface):
-        if self.spritesheet:
-            surface.blit(self.spritesheet, self.view_rect, self.camera)
-        try:
-            pygame.draw.rect(surface, (255,255,255), self.select_rect, 1)
-        except TypeError:
-            print ('Rect %s' % self.select_rect)
+        if isinstance(self.spritesheet, TiledSheet):
+            self.spritesheet.draw(surface, self.view_rect, self.origin,
+                                  self.zoom)
+        elif self.spritesheet:
+            if not self.zoomed or self.zoomed.sheet is not self.spritesheet:
+                self.zoomed = ZoomedSheet(self.spritesheet)
+            self.zoomed.draw(surface, self.view_rect, self.origin, self.zoom)
+        pygame.draw.rect(surface, (255,255,255), self.outline(), 1)
         super().draw(surface)
 
     def reset(self):
         super().reset()
+        self.set_frames(None)
+
+    def set_frames(self, frames):
+        """The frames that can be picked, to be passed again whenever
+        frames are added or removed"""
+        self.frames = frames
+        self.index_stale = True
+
+    def frame_inserted(self, frames, index):
+        """Keeps the index current when a frame is appended, the usual
+        case, instead of rebuilding it on the next pick"""
+        self.frames = frames
+        if not self.index_stale and index == len(self.frame_index):
+            self.frame_index.insert(index, frames[index].rect)
+        else:
+            self.index_stale = True
+
+    def frame_removed(self, frames, index):
+        self.frames = frames
+        if not self.index_stale and index == len(self.frame_index) - 1:
+            self.frame_index.remove(index)
+        else:
+            self.index_stale = True
+
+    def frame_at(self, pos):
+        """Index of the frame under screen point pos, or None"""
+        if not self.frames or not self.view_rect.collidepoint(pos):
+            return None
+        if self.index_stale:
+            self.frame_index.clear()
+            for i, frame in enumerate(self.frames):
+                self.frame_index.insert(i, frame.rect)
+            self.index_stale = False
+        ox, oy = self.origin
+        point = (math.floor(ox + (pos[0] - self.view_rect.x) / self.zoom),
+                 math.floor(oy + (pos[1] - self.view_rect.y) / self.zoom))
+        return self.frame_index.pick(point)
+
+    def pick_frame(self, pos):
+        index = self.frame_at(pos)
+        if index is None:
+            self.select_rect = None
+            return
+        self.select_rect = self.frame_index.rects[index].copy()
+        self.picked = index
+
+    def take_picked(self):
+        """Returns the frame picked since the last call, or None"""
+        picked, self.picked = self.picked, None
+        return picked
 
     def get_clip(self):
         """Returns current selection on spritesheet"""
-        return self.cam_to_sheet(self.select_rect)
+        return self.select_rect.copy() if self.select_rect else None
 
     def cam_to_sheet(self, rect):
         """Gets rect of selection in terms of spritesheet's coords"""
         if rect.w == 0 or rect.h == 0:
             return None
-        camx, camy = self.camera.x, self.camera.y
-        clip = pygame.Rect(rect.x + camx,
-                           rect.y + camy,
-                           rect.w,
-                           rect.h)
-        return clip
+        # map both corners so a rect dragged up or left keeps its sign
+        ox, oy = self.origin
+        vx, vy = self.view_rect.topleft
+        x0 = math.floor(ox + (rect.x - vx) / self.zoom)
+        y0 = math.floor(oy + (rect.y - vy) / self.zoom)
+        x1 = math.floor(ox + (rect.x + rect.w - vx) / self.zoom)
+        y1 = math.floor(oy + (rect.y + rect.h - vy) / self.zoom)
+        if x0 == x1 or y0 == y1:
+            return None
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
 
     def sheet_to_cam(self, rect):
         """Returns rect in sheet coords to cam coords"""
         if rect.w == 0 or rect.h == 0:
             return None
-        camx, camy = self.camera.x, self.camera.y
-        clip = pygame.Rect(rect.x - camx,
-                           rect.y - camy,
-                           rect.w,
-                           rect.h)
-        return clip
+        ox, oy = self.origin
+        vx, vy = self.view_rect.topleft
+        x0 = vx + round((rect.x - ox) * self.zoom)
+        y0 = vy + round((rect.y - oy) * self.zoom)
+        x1 = vx + round((rect.x + rect.w - ox) * self.zoom)
+        y1 = vy + round((rect.y + rect.h - oy) * self.zoom)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
 
     def shrink_frame(self, image, rect):
         """Given an initial rect around the sprite, returns the smallest rect that contains the sprite."""
-        mask = image.get_at((rect.x, rect.y))
-        new_x = -1
-        new_y = -1
-        new_w = -1
-        new_h = -1
-
-        # Scan from outside in from each edge to find the first
-        # non-mask pixel. That is the closest point to contain
-        # the sprite on that respective side. UGLY CODE BUT
-        # IT WORKS.
-        
-        # top scan
-        for y in range(rect.y, rect.y + rect.h + 1):
-                for x in range(rect.x, rect.x + rect.w + 1):
-                        try:
-                                color = image.get_at((x,y))
-                        except:
-                                continue
-                        if color != mask and new_y == -1:
-                                new_y = y
-        # left scan
-        for x in range(rect.x, rect.x + rect.w + 1):
-                for y in range(rect.y, rect.y + rect.h + 1):
-                        try:
-                                color = image.get_at((x,y))
-                        except:
-                                continue
-                        if color != mask and new_x == -1:
-                                new_x = x
-
-        # bottom scan
-        for y in range(rect.y + rect.h, rect.y-1, -1):
-                for x in range(rect.x, rect.x + rect.w + 1):
-                        try:
-                                color = image.get_at((x,y))
-                        except:
-                                continue
-                        if color != mask and new_h == -1:
-                                new_h = y
-
-        # right scan
-        for x in range(rect.x + rect.w, rect.x-1, -1):
-                for y in range(rect.y, rect.y + rect.h + 1):
-                        try:
-                                color = image.get_at((x,y))
-                        except:
-                                continue
-                        if color != mask and new_w == -1:
-                                new_w = x
-
-        new_rect = pygame.Rect(new_x, new_y, new_w - new_x, new_h - new_y)
-        new_rect = self.sheet_to_cam(new_rect)
-        return new_rect     
+        with self.profiler.phase('shrink_frame'):
+            new_rect = trim_rect(image, rect)
+        return new_rect or None
 
 class FrameSubView(SubView):
+    # how near a corner of the selected box, in screen pixels, resizes it
+    HANDLE = 4
+    OPPOSITE = {'topleft': 'bottomright', 'topright': 'bottomleft',
+                'bottomleft': 'topright', 'bottomright': 'topleft'}
+
     def __init__(self, parent, rect_coords):
         super().__init__(parent, rect_coords, 'Frame View')
         self.frame = None
@@ -183,18 +321,42 @@ class FrameSubView(SubView):
                                       0)
         self.box = pygame.Rect(0,0,0,0)
         self.has_clicked = False
+        self.surfaces = None
+        # the frame's animation and index, for onion skinning
+        self.animation = None
+        self.index = None
+        self.onion = 0
+        self.onion_skin = None
+        # the frame's boxes keyed by (kind, index), in frame coords
+        self.boxes = GridIndex(16)
+        self.indexed = None
+        # edits reach the frame through set_frame, so the index is only
+        # checked against the frame after a set_frame
+        self.boxes_stale = True
+        self.selected = None
+        # (mode, corner, start, original rect) while a box is dragged
+        self.drag = None
+        self.edit_rect = None
+        self.edit = None
 
     def handle_event(self, event):
         super().handle_event(event)
         if event.type == pygame.MOUSEBUTTONDOWN:
-            in_bounds = self.view_rect.collidepoint(pygame.mouse.get_pos())
+            pos = pygame.mouse.get_pos()
+            in_bounds = self.view_rect.collidepoint(pos)
+            if event.button == 1 and in_bounds and self.grab_box(pos):
+                return
             if event.button == 1 and in_bounds:
+                old_box = self.box.copy()
                 self.has_clicked = True
                 self.box.x, self.box.y = pygame.mouse.get_pos()
+                self.box_changed(old_box)
                 
         elif event.type == pygame.MOUSEBUTTONUP:
             self.has_clicked = False
-            if event.button == 1 and self.frame != None:
+            if event.button == 1 and self.drag:
+                self.drop_box()
+            elif event.button == 1 and self.frame != None:
                 # restrict rect to spritesheet's bounds
                 mx, my = pygame.mouse.get_pos()
                 select_start = (self.box.x, self.box.y)
@@ -209,56 +371,246 @@ class FrameSubView(SubView):
 
     def tick(self):
         super().tick()
+        if pygame.mouse.get_pressed()[0] and self.drag:
+            self.drag_box(pygame.mouse.get_pos())
         # Update box size
-        if pygame.mouse.get_pressed()[0] and self.has_clicked:
+        elif pygame.mouse.get_pressed()[0] and self.has_clicked:
+            old_box = self.box.copy()
             mx, my = pygame.mouse.get_pos()
             self.box.w = mx - self.box.x
             self.box.h = my - self.box.y
+            self.box_changed(old_box)
+
+    def box_changed(self, old_box):
+        if self.box != old_box:
+            self.invalidate_box(old_box)
+            self.invalidate_box(self.box)
+
+    def is_dragging(self):
+        boxing = pygame.mouse.get_pressed()[0] and \
+            (self.has_clicked or self.drag)
+        return boxing or super().is_dragging()
+
+    def box_index(self):
+        """The index of the frame's boxes, rebuilt if they changed"""
+        if not self.boxes_stale:
+            return self.boxes
+        self.boxes_stale = False
+        key = pose_key(self.frame) if self.frame else None
+        if key != self.indexed:
+            self.boxes.clear()
+            if self.frame:
+                for kind, boxes in (('hitbox', self.frame.hitboxes),
+                                    ('damagebox', self.frame.damageboxes)):
+                    for i, box in enumerate(boxes):
+                        self.boxes.insert((kind, i), box)
+            self.indexed = key
+            if self.selected not in self.boxes:
+                self.selected = None
+        return self.boxes
+
+    def frame_point(self, pos):
+        fx, fy = self.frame_rect.topleft
+        return (math.floor((pos[0] - fx) / self.zoom),
+                math.floor((pos[1] - fy) / self.zoom))
+
+    def handle_at(self, pos):
+        """Which corner of the selected box pos is on, or None"""
+        if self.selected is None:
+            return None
+        rect = self.frame_to_screen(self.box_index().rects[self.selected])
+        for corner in ('topleft', 'topright', 'bottomleft', 'bottomright'):
+            x, y = getattr(rect, corner)
+            if abs(pos[0] - x) <= self.HANDLE and \
+                    abs(pos[1] - y) <= self.HANDLE:
+                return corner
+        return None
+
+    def grab_box(self, pos):
+        """Starts moving or resizing the box under pos. Returns False if
+        there is no box there."""
+        if not self.frame:
+            return False
+        boxes = self.box_index()
+        corner = self.handle_at(pos)
+        if corner:
+            key = self.selected
+        else:
+            key = boxes.pick(self.frame_point(pos))
+        if self.selected != key:
+            self.invalidate()
+        self.selected = key
+        if key is None:
+            return False
+        rect = boxes.rects[key]
+        self.drag = ('resize' if corner else 'move', corner, pos, rect)
+        self.edit_rect = rect.copy()
+        return True
+
+    def drag_box(self, pos):
+        mode, corner, start, rect = self.drag
+        if mode == 'move':
+            new = rect.move(round((pos[0] - start[0]) / self.zoom),
+                            round((pos[1] - start[1]) / self.zoom))
+        else:
+            # the opposite corner stays put
+            screen = self.frame_to_screen(rect)
+            fixed = getattr(screen, self.OPPOSITE[corner])
+            new = self.screen_to_frame(pygame.Rect(
+                fixed, (pos[0] - fixed[0], pos[1] - fixed[1])))
+            new.normalize()
+        if new != self.edit_rect and new.w and new.h:
+            # wide enough to take the corner handles too
+            self.invalidate(self.frame_to_screen(self.edit_rect).inflate(8, 8))
+            self.invalidate(self.frame_to_screen(new).inflate(8, 8))
+            self.edit_rect = new
+
+    def drop_box(self):
+        mode, corner, start, rect = self.drag
+        if self.edit_rect != rect:
+            kind, index = self.selected
+            self.edit = (kind, index, rect, self.edit_rect)
+        self.drag = None
+        self.edit_rect = None
+        self.invalidate()
+
+    def take_box_edit(self):
+        """Returns (kind, index, old, new) for a box dragged since the last
+        call, or None"""
+        edit, self.edit = self.edit, None
+        return edit
 
     def screen_to_frame(self, screen_rect):
-        nx = screen_rect.x - self.frame_rect.x
-        ny = screen_rect.y - self.frame_rect.y
-        w, h = screen_rect.w, screen_rect.h
-        return pygame.Rect(nx, ny, w, h)
+        # snap each corner to the nearest pixel edge at the current zoom
+        fx, fy = self.frame_rect.topleft
+        x0 = round((screen_rect.x - fx) / self.zoom)
+        y0 = round((screen_rect.y - fy) / self.zoom)
+        x1 = round((screen_rect.x + screen_rect.w - fx) / self.zoom)
+        y1 = round((screen_rect.y + screen_rect.h - fy) / self.zoom)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
 
     def frame_to_screen(self, rect):
-        nx = rect.x + self.frame_rect.x
-        ny = rect.y + self.frame_rect.y
-        w, h = rect.w, rect.h
-        return pygame.Rect(nx, ny, w, h)
+        fx, fy = self.frame_rect.topleft
+        x0 = fx + round(rect.x * self.zoom)
+        y0 = fy + round(rect.y * self.zoom)
+        x1 = fx + round((rect.x + rect.w) * self.zoom)
+        y1 = fy + round((rect.y + rect.h) * self.zoom)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+
+    def pan(self, dx, dy):
+        self.frame_rect.move_ip(-dx, -dy)
+        self.box.move_ip(-dx, -dy)
+        self.invalidate()
+
+    def zoom_at(self, pos, zoom):
+        if zoom == self.zoom:
+            return
+        box = self.screen_to_frame(self.box) if self.valid_box() else None
+        scale = zoom / self.zoom
+        self.frame_rect.x = pos[0] - round((pos[0] - self.frame_rect.x) * scale)
+        self.frame_rect.y = pos[1] - round((pos[1] - self.frame_rect.y) * scale)
+        self.zoom = zoom
+        self.fit_frame()
+        if box:
+            self.box = self.frame_to_screen(box)
+        self.invalidate()
+
+    def fit_frame(self):
+        """Sizes frame_rect to the frame at the current zoom"""
+        if self.frame:
+            self.frame_rect.w = round(self.frame.rect.w * self.zoom)
+            self.frame_rect.h = round(self.frame.rect.h * self.zoom)
 
     def draw(self, surface):
         super().draw(surface)
         if self.frame and self.spritesheet:
-            surface.blit(self.spritesheet, self.frame_rect, self.frame.rect)
-            for hbox in self.frame.hitboxes:
-                # frame coords to screen cords
-                rect = self.frame_to_screen(hbox)
-                pygame.draw.rect(surface, (0,0,255), rect, 1)
-            for dbox in self.frame.damageboxes:
-                rect = self.frame_to_screen(dbox)
-                pygame.draw.rect(surface, (255, 0, 0), rect, 1)
+            if self.surfaces is None or \
+                    self.surfaces.sheet is not self.spritesheet:
+                self.surfaces = FrameSurfaceCache(self.spritesheet)
+                self.onion_skin = OnionSkin(FrameLayers(self.surfaces))
+            if self.onion and self.animation and self.index is not None:
+                self.draw_onion(surface)
+            entry = self.surfaces.get(self.frame.rect, scale=self.zoom)
+            if entry:
+                image, offset = entry
+                surface.blit(image, self.frame_rect.move(offset))
+            self.draw_boxes(surface)
         pygame.draw.rect(surface, (255,0,0), self.box, 1)
 
+    def draw_boxes(self, surface):
+        # only the boxes under the area being redrawn
+        boxes = self.box_index()
+        clip = self.screen_to_frame(surface.get_clip()).inflate(2, 2)
+        keys = [key for key in boxes.query(clip) if key != self.selected]
+        # the selected box goes on top, and where it is being dragged to
+        # rather than where the index has it
+        if self.selected is not None:
+            keys.append(self.selected)
+        for key in keys:
+            rect = boxes.rects[key]
+            if key == self.selected and self.edit_rect:
+                rect = self.edit_rect
+            # frame coords to screen cords
+            rect = self.frame_to_screen(rect)
+            color = (0,0,255) if key[0] == 'hitbox' else (255,0,0)
+            pygame.draw.rect(surface, color, rect, 1)
+            if key == self.selected:
+                for corner in self.OPPOSITE:
+                    handle = pygame.Rect(0, 0, 5, 5)
+                    handle.center = getattr(rect, corner)
+                    pygame.draw.rect(surface, (255,255,0), handle)
+
+    def draw_onion(self, surface):
+        layers = self.onion_skin.layers
+        if len(layers.layers) > 8 * self.onion + 64:
+            layers.prune(self.animation.frames)
+        skin = self.onion_skin.render(self.animation.frames, self.index,
+                                      self.onion, self.zoom)
+        if skin:
+            image, offset = skin
+            surface.blit(image, self.frame_rect.move(offset))
+
     def reset(self):
         super().reset()
         self.frame = None
-
-    def set_frame(self, frame):
+        self.animation = None
+        self.index = None
+        self.selected = None
+        self.drag = None
+        self.edit_rect = None
+        self.boxes_stale = True
+        self.clear_surfaces()
+
+    def clear_surfaces(self):
+        """Drops every cut out frame, for when the sheet changes"""
+        self.surfaces = None
+        self.onion_skin = None
+
+    def prune_surfaces(self, frames):
+        """Drops the cut out frames no frame in frames uses any more"""
+        if self.surfaces is not None:
+            self.surfaces.prune(frame.rect for frame in frames)
+            self.onion_skin.layers.prune(frames)
+
+    def set_frame(self, frame, animation=None, index=None):
+        if index is None or index != self.index:
+            self.selected = None
         self.frame = frame
-        if frame:
-            self.frame_rect.w = self.frame.rect.w
-            self.frame_rect.h = self.frame.rect.h
-
-    def add_hitbox(self):
-        if self.valid_box() and self.frame:
-            rect = self.screen_to_frame(self.box)
-            self.frame.add_hitbox(rect)
-
-    def add_damagebox(self):
+        self.animation = animation
+        self.index = index
+        self.boxes_stale = True
+        self.invalidate()
+        self.fit_frame()
+
+    def set_onion(self, count):
+        """Shows count frames either side of this one underneath it"""
+        self.onion = count
+        self.invalidate()
+
+    def new_box(self):
+        """The box drawn over the frame in frame coordinates, or None"""
         if self.valid_box() and self.frame:
-            rect = self.screen_to_frame(self.box)
-            self.frame.add_damagebox(rect)
+            return self.screen_to_frame(self.box)
 
     def valid_box(self):
         return self.box.w != 0 and self.box.h != 0
@@ -269,38 +621,112 @@ class AnimationSubView(SubView):
         self.animation = None
         self.is_playing = False
         self.loop = False
+        self.last_tick = 0
+        self.show_filmstrip = False
+        self.filmstrip = None
+        self.surfaces = None
+        self.selected = None
+        self.picked = None
 
     def handle_event(self, event):
         super().handle_event(event)
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            pos = pygame.mouse.get_pos()
+            if self.view_rect.collidepoint(pos):
+                self.pick_cell(pos)
+
+    def pick_cell(self, pos):
+        """Picks the frame whose filmstrip cell is under screen point pos"""
+        if not (self.show_filmstrip and self.filmstrip and self.animation):
+            return
+        x, y = self.strip_origin()
+        index = self.filmstrip.index_at((pos[0] - x, pos[1] - y))
+        if index is not None and index < len(self.animation.frames):
+            self.picked = index
+
+    def take_picked(self):
+        """Returns the frame picked since the last call, or None"""
+        picked, self.picked = self.picked, None
+        return picked
+
+    def strip_origin(self):
+        """Where the filmstrip's top left is on screen"""
+        # right-drag scrolls the strip
+        return (self.view_rect.x - (self.camera.x - self.view_rect.x),
+                self.view_rect.y + 20 - (self.camera.y - self.view_rect.y))
 
     def tick(self):
         super().tick()
         if self.animation and self.is_playing:
-            if self.animation.is_complete() and not self.loop:
+            # Step by elapsed time so playback speed doesn't depend on
+            # how often the scheduler gets to tick
+            now = time.perf_counter()
+            shown = self.animation.current_frame
+            if not self.animation.advance(now - self.last_tick, self.loop):
                 self.is_playing = False
-            else:
-                self.animation.step()
+            self.last_tick = now
+            if self.animation.current_frame != shown:
+                self.invalidate()
 
     def play_animation(self):
         if self.animation and not self.is_playing:
             self.is_playing = True
             self.animation.restart()
+            self.last_tick = time.perf_counter()
+            self.invalidate()
 
     def draw(self, surface):
         super().draw(surface)
-        if self.animation:
+        if self.animation and self.show_filmstrip:
+            self.draw_filmstrip(surface)
+        elif self.animation:
+            if self.animation.surfaces is None:
+                self.animation.cache_surfaces()
             self.animation.draw(surface, self.view_rect.centerx,
                                 self.view_rect.centery)
 
+    def draw_filmstrip(self, surface):
+        if not self.spritesheet:
+            return
+        if self.surfaces is None or \
+                self.surfaces.sheet is not self.spritesheet:
+            self.surfaces = FrameSurfaceCache(self.spritesheet)
+            self.filmstrip = Filmstrip(FrameLayers(self.surfaces))
+        strip = self.filmstrip.render(self.animation.frames,
+                                      self.view_rect.w)
+        x, y = self.strip_origin()
+        clip = surface.get_clip()
+        surface.set_clip(clip.clip(self.view_rect))
+        surface.blit(strip, (x, y))
+        if self.selected is not None and \
+                self.selected < len(self.animation.frames):
+            cell = self.filmstrip.cell_rect(self.selected).move(x, y)
+            pygame.draw.rect(surface, (255, 255, 0), cell.inflate(2, 2), 1)
+        surface.set_clip(clip)
+
+    def set_filmstrip(self, enabled):
+        self.show_filmstrip = enabled
+        self.invalidate()
+
     def reset(self):
         super().reset()
         self.animation = None
-        self.play = False
+        self.is_playing = False
+        self.selected = None
+        self.picked = None
 
     def add_frame(self, frame):
         if not self.animation:
             self.animation = Animation(self.spritesheet)
         self.animation.add_frame(frame)
+        self.invalidate()
+
+    def insert_frame(self, index, frame):
+        if not self.animation:
+            self.animation = Animation(self.spritesheet)
+        self.animation.insert_frame(index, frame)
+        self.animation.restart()
+        self.invalidate()
 
     def remove_frame(self, index):
         if self.animation:
@@ -308,4 +734,5 @@ class AnimationSubView(SubView):
             self.animation.restart()
             if not frame:
                 self.animation = None
+            self.invalidate()
             return frame
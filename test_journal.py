@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+import journal
+from animation import Animation, AnimFrame
+
+
+def _frame(x):
+    return AnimFrame(pygame.Rect(x, 0, 8, 8))
+
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.autosave_dir = journal.AUTOSAVE_DIR
+        journal.AUTOSAVE_DIR = self.folder
+        self.write_file = journal._write_file
+
+    def tearDown(self):
+        journal._write_file = self.write_file
+        journal.AUTOSAVE_DIR = self.autosave_dir
+        shutil.rmtree(self.folder)
+
+    def edit(self, j, anim, x):
+        frame = _frame(x)
+        anim.add_frame(frame)
+        j.record('insert_frame', index=len(anim.frames) - 1,
+                 frame=journal.frame_record(frame))
+
+    def test_edits_between_overlapping_compactions_are_kept(self):
+        path = os.path.join(self.folder, 'untitled-1.journal')
+        j = journal.EditJournal(path)
+        anim = Animation(None)
+        for x in range(3):
+            self.edit(j, anim, x * 8)
+
+        # hold the first compaction in its write until the second is queued
+        release = threading.Event()
+        def slow_write(target, data):
+            if target.endswith('-1' + journal.animation.BINARY_EXT):
+                release.wait(5)
+            self.write_file(target, data)
+        journal._write_file = slow_write
+
+        first = j.compact(anim)
+        self.edit(j, anim, 24)
+        saved = os.path.join(self.folder, 'saved.banim')
+        second = j.compact(anim, saved)
+        self.edit(j, anim, 32)
+        release.set()
+        first.result()
+        second.result()
+        j.close()
+
+        self.assertEqual(len(j.pending), 1)
+        sheet, recovered, base = journal.recover(j.path)
+        self.assertEqual([tuple(f.rect) for f in recovered.frames],
+                         [tuple(f.rect) for f in anim.frames])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,342 @@
+"""Spritesheets too big to keep in memory as one Surface.
+
+The first time a big sheet is opened it is decoded once and its pixels
+are written out, a band of rows at a time, to a raw file in TILE_DIR.
+From then on that file is memory mapped and the sheet is handed out in
+square tiles: only tiles that get drawn become Surfaces, those are kept
+in an LRU up to a byte budget, and the ring of tiles around the view is
+loaded a couple at a time so panning finds them ready. TILE_DIR is kept
+under TILE_DIR_BUDGET bytes by deleting the files of the sheets opened
+longest ago.
+"""
+import hashlib
+import math
+import os
+import struct
+from collections import OrderedDict
+import numpy
+import pygame
+from sheetcache import DEFAULT_BUDGET, SheetCache, convert_sheet
+
+TILE_DIR = os.path.join(os.path.expanduser('~'), '.bones', 'tiles')
+TILE_SIZE = 512
+TILE_BUDGET = 128 * 1024 * 1024
+TILE_DIR_BUDGET = 2 * 1024 * 1024 * 1024
+# sheets with more pixels than this are opened tiled
+TILED_PIXELS = 4096 * 4096
+# ring tiles loaded per draw that didn't have to load a visible tile
+PREFETCH = 2
+
+# Raw tile files: magic, version, width, height, alpha and colour key
+# flags, the colour key, then the source file's mtime and size, padded to
+# DATA_OFFSET. Pixels follow as rows of RGBA or RGBX bytes.
+TILES_MAGIC = b'BTIL'
+TILES_VERSION = 1
+_HEADER = struct.Struct('<4sIIIBB2x4BdQ')
+DATA_OFFSET = 64
+_BAND = 256
+
+
+def png_size(path):
+    """Reads (width, height) from a PNG's header, None for other files"""
+    with open(path, 'rb') as f:
+        head = f.read(24)
+    if head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', head[16:24])
+
+
+def tiles_path(path, tile_dir=TILE_DIR):
+    path = os.path.abspath(path)
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tile_dir, '%s-%s.tiles'
+                        % (os.path.basename(path), digest))
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def _read_header(raw):
+    with open(raw, 'rb') as f:
+        data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        return None
+    header = _HEADER.unpack(data)
+    if header[0] != TILES_MAGIC or header[1] != TILES_VERSION:
+        return None
+    return header
+
+
+def build_tiles(path, raw):
+    """Decodes the image at path once and writes its pixels to raw. The
+    decoded Surface is only held while the file is written."""
+    image = pygame.image.load(path)
+    w, h = image.get_size()
+    alpha = bool(image.get_flags() & pygame.SRCALPHA)
+    colorkey = image.get_colorkey()
+    mode = 'RGBA' if alpha else 'RGBX'
+    mtime, size = _source_stamp(path)
+    header = _HEADER.pack(TILES_MAGIC, TILES_VERSION, w, h, alpha,
+                          colorkey is not None, *(colorkey or (0, 0, 0, 0)),
+                          mtime, size)
+    os.makedirs(os.path.dirname(raw), exist_ok=True)
+    tmp = raw + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header.ljust(DATA_OFFSET, b'\0'))
+        for y in range(0, h, _BAND):
+            band = image.subsurface((0, y, w, min(_BAND, h - y)))
+            f.write(pygame.image.tostring(band, mode))
+    os.replace(tmp, raw)
+
+
+def prune_tiles(tile_dir=TILE_DIR, budget=TILE_DIR_BUDGET, keep=()):
+    """Deletes the least recently opened raw tile files until those left
+    in tile_dir take at most budget bytes. Files in keep stay, and so do
+    files another process still has open where that stops a delete."""
+    try:
+        names = os.listdir(tile_dir)
+    except FileNotFoundError:
+        return
+    files = []
+    for name in names:
+        if not name.endswith('.tiles'):
+            continue
+        path = os.path.join(tile_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    used = sum(size for mtime, size, path in files)
+    keep = set(os.path.abspath(path) for path in keep)
+    for mtime, size, path in sorted(files):
+        if used <= budget:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        used -= size
+
+
+class TiledSheet:
+    """A spritesheet read through memory mapped tiles.
+
+    It answers the parts of the Surface interface the editor uses on
+    sheets (get_rect, get_at, get_colorkey, subsurface and friends) so
+    trimming and frame rendering work on it unchanged; subsurface returns
+    a new Surface holding a copy of the region. Draw it with draw rather
+    than blitting it.
+    """
+    def __init__(self, path, tile_size=TILE_SIZE, budget=TILE_BUDGET,
+                 tile_dir=TILE_DIR, dir_budget=TILE_DIR_BUDGET):
+        self.path = path
+        self.tile_size = tile_size
+        self.budget = budget
+        self.raw = tiles_path(path, tile_dir)
+        header = _read_header(self.raw) if os.path.exists(self.raw) else None
+        if not header or header[-2:] != _source_stamp(path):
+            build_tiles(path, self.raw)
+            header = _read_header(self.raw)
+            prune_tiles(tile_dir, dir_budget, keep=(self.raw,))
+        else:
+            # the mtime orders files for prune_tiles
+            os.utime(self.raw)
+        (magic, version, w, h, alpha, keyed, r, g, b, a,
+         mtime, size) = header
+        self.size = (w, h)
+        self.alpha = bool(alpha)
+        self.colorkey = pygame.Color(r, g, b, a) if keyed else None
+        self.mode = 'RGBA' if self.alpha else 'RGBX'
+        self.pixels = numpy.memmap(self.raw, numpy.uint8, 'r', DATA_OFFSET,
+                                   (h, w, 4))
+        # regions handed out share this pixel format
+        self.format = self._surface(numpy.zeros((1, 1, 4), numpy.uint8))
+        self.tiles = OrderedDict()
+        self.used = 0
+        self.wanted = []
+        self.magnified = None
+
+    # Surface-like interface
+
+    def get_size(self):
+        return self.size
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def get_rect(self, **kwargs):
+        rect = pygame.Rect((0, 0), self.size)
+        for name, value in kwargs.items():
+            setattr(rect, name, value)
+        return rect
+
+    def get_flags(self):
+        return self.format.get_flags()
+
+    def get_colorkey(self):
+        return self.colorkey
+
+    def get_masks(self):
+        return self.format.get_masks()
+
+    def map_rgb(self, color):
+        return self.format.map_rgb(color)
+
+    def get_at(self, pos):
+        x, y = pos
+        if not (0 <= x < self.size[0] and 0 <= y < self.size[1]):
+            raise IndexError('pixel index out of range')
+        r, g, b, a = self.pixels[y, x].tolist()
+        return pygame.Color(r, g, b, a if self.alpha else 255)
+
+    def subsurface(self, rect):
+        rect = pygame.Rect(rect)
+        if not self.get_rect().contains(rect):
+            raise ValueError('subsurface rectangle outside surface area')
+        return self._surface(self.pixels[rect.top:rect.bottom,
+                                         rect.left:rect.right])
+
+    def _surface(self, pixels):
+        """A Surface of the sheet's format holding a copy of pixels"""
+        h, w = pixels.shape[:2]
+        data = numpy.ascontiguousarray(pixels).tobytes()
+        surface = pygame.image.fromstring(data, (w, h), self.mode)
+        if self.colorkey is not None:
+            surface.set_colorkey(self.colorkey)
+        return surface
+
+    # Tiles
+
+    def tile_rect(self, tx, ty):
+        size = self.tile_size
+        return pygame.Rect(tx * size, ty * size, size, size).clip(
+            self.get_rect())
+
+    def tile(self, tx, ty, zoom=1):
+        """The display ready Surface for tile (tx, ty) at zoom, which is 1
+        or a power of two below it"""
+        key = (tx, ty, zoom)
+        surface = self.tiles.get(key)
+        if surface is not None:
+            self.tiles.move_to_end(key)
+            return surface
+        rect = self.tile_rect(tx, ty)
+        # zoomed out tiles sample every step'th pixel straight from the
+        # mapped file, so the full tile is never read in
+        step = int(round(1 / zoom))
+        pixels = self.pixels[rect.top:rect.bottom:step,
+                             rect.left:rect.right:step]
+        surface = convert_sheet(self._surface(pixels))
+        self.tiles[key] = surface
+        self.used += surface.get_pitch() * surface.get_height()
+        # never evict the tile that was just added
+        while self.used > self.budget and len(self.tiles) > 1:
+            old_key, old = self.tiles.popitem(last=False)
+            self.used -= old.get_pitch() * old.get_height()
+        return surface
+
+    def tile_range(self, rect):
+        """(tx0, ty0, tx1, ty1) of the tiles under a sheet rect, ends
+        exclusive"""
+        rect = rect.clip(self.get_rect())
+        if not rect:
+            return (0, 0, 0, 0)
+        size = self.tile_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size + 1, (rect.bottom - 1) // size + 1)
+
+    def draw(self, surface, dest, origin, zoom):
+        """Fills dest on surface with the sheet at zoom, with sheet point
+        origin at dest's top left. Takes the same zoom levels as
+        framecache.ZoomedSheet."""
+        if zoom > 1:
+            self._draw_magnified(surface, dest, origin, zoom)
+            return
+        ox, oy = origin
+        view = pygame.Rect(math.floor(ox), math.floor(oy),
+                           math.ceil(dest.w / zoom) + 1,
+                           math.ceil(dest.h / zoom) + 1)
+        tx0, ty0, tx1, ty1 = self.tile_range(view)
+        loaded = len(self.tiles)
+        blits = []
+        size = self.tile_size
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                pos = (dest.x + round((tx * size - ox) * zoom),
+                       dest.y + round((ty * size - oy) * zoom))
+                blits.append((self.tile(tx, ty, zoom), pos))
+        clip = surface.get_clip()
+        surface.set_clip(clip.clip(dest))
+        surface.blits(blits, doreturn=False)
+        surface.set_clip(clip)
+
+        self.wanted = [(tx, ty, zoom)
+                       for ty in range(ty0 - 1, ty1 + 1)
+                       for tx in range(tx0 - 1, tx1 + 1)
+                       if (tx, ty, zoom) not in self.tiles and
+                       self.tile_rect(tx, ty)]
+        if len(self.tiles) == loaded:
+            self.prefetch(PREFETCH)
+
+    def prefetch(self, count):
+        """Loads up to count tiles from the ring around the last view"""
+        while self.wanted and count > 0:
+            tx, ty, zoom = self.wanted.pop()
+            if (tx, ty, zoom) not in self.tiles:
+                self.tile(tx, ty, zoom)
+                count -= 1
+
+    def _draw_magnified(self, surface, dest, origin, zoom):
+        # only the handful of sheet pixels in view get scaled up
+        ox, oy = origin
+        src = pygame.Rect(math.floor(ox), math.floor(oy),
+                          math.ceil(dest.w / zoom) + 1,
+                          math.ceil(dest.h / zoom) + 1)
+        src = src.clip(self.get_rect())
+        if not src:
+            return
+        key = (tuple(src), zoom)
+        if not self.magnified or self.magnified[0] != key:
+            scaled = pygame.transform.scale(self.subsurface(src),
+                                            (src.w * zoom, src.h * zoom))
+            self.magnified = (key, convert_sheet(scaled))
+        x = dest.x + round((src.x - ox) * zoom)
+        y = dest.y + round((src.y - oy) * zoom)
+        surface.blit(self.magnified[1], dest,
+                     pygame.Rect(dest.x - x, dest.y - y, dest.w, dest.h))
+
+
+class TiledSheetCache(SheetCache):
+    """SheetCache that opens sheets over tiled_pixels as TiledSheets.
+
+    Only PNGs can be sized without decoding them, so other formats are
+    always loaded whole.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET, tiled_pixels=TILED_PIXELS,
+                 tile_dir=TILE_DIR, dir_budget=TILE_DIR_BUDGET):
+        super().__init__(budget)
+        self.tiled_pixels = tiled_pixels
+        self.tile_dir = tile_dir
+        self.dir_budget = dir_budget
+
+    def decode(self, path):
+        # tiles are converted as they are drawn, so finish leaves a
+        # TiledSheet alone
+        size = png_size(path)
+        if size and size[0] * size[1] > self.tiled_pixels:
+            return TiledSheet(path, tile_dir=self.tile_dir,
+                              dir_budget=self.dir_budget)
+        return super().decode(path)
+
+    def size_of(self, surface):
+        if isinstance(surface, TiledSheet):
+            return surface.budget
+        return super().size_of(surface)
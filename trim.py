@@ -0,0 +1,122 @@
+import numpy
+import pygame
+
+# Pixels are compared on their colour channels only, unless the image
+# keeps per-pixel alpha and the background itself is transparent, in
+# which case any pixel that is not fully transparent is foreground.
+ALPHA = 'alpha'
+
+
+def _pixels(surface):
+    """Returns a 2d array of mapped pixel values, indexed [x][y]"""
+    try:
+        return pygame.surfarray.pixels2d(surface)
+    except ValueError:
+        # 24 bit surfaces can't be referenced directly
+        return pygame.surfarray.array2d(surface)
+
+
+def _alpha(surface):
+    """Returns a 2d array of the surface's per-pixel alpha, indexed [x][y]"""
+    try:
+        return pygame.surfarray.pixels_alpha(surface)
+    except ValueError:
+        return pygame.surfarray.array_alpha(surface)
+
+
+def background_of(image, rect=None, background=None):
+    """Works out what counts as background inside rect.
+
+    Returns ALPHA when transparency separates the sprites from the sheet,
+    otherwise the background colour. An explicit background colour always
+    wins, then the image's colour key, then the top left pixel of rect.
+    """
+    if background is not None:
+        return pygame.Color(background)
+    colorkey = image.get_colorkey()
+    if colorkey is not None:
+        return pygame.Color(colorkey)
+    if rect is None:
+        rect = image.get_rect()
+    ref = image.get_at((rect.x, rect.y))
+    if image.get_flags() & pygame.SRCALPHA and ref.a == 0:
+        return ALPHA
+    return ref
+
+
+def foreground_mask(image, rect=None, background=None):
+    """Returns a boolean [x][y] array of the non-background pixels in rect"""
+    if rect is None:
+        rect = image.get_rect()
+    bg = background_of(image, rect, background)
+    region = image.subsurface(rect)
+    if bg is ALPHA:
+        return _alpha(region) != 0
+    pixels = _pixels(region)
+    rgb = sum(image.get_masks()[:3])
+    mapped = image.map_rgb(bg)
+    if not rgb:
+        # palettized surface, the mapped value is a palette index
+        return pixels != mapped
+    return (pixels & rgb) != (mapped & rgb)
+
+
+def trim_rect(image, rect=None, background=None):
+    """Returns the smallest rect inside rect that holds every foreground
+    pixel of image, in image coords. None if there is no foreground."""
+    if rect is None:
+        rect = image.get_rect()
+    rect = pygame.Rect(rect).clip(image.get_rect())
+    if rect.w == 0 or rect.h == 0:
+        return None
+    mask = foreground_mask(image, rect, background)
+    cols = numpy.flatnonzero(mask.any(axis=1))
+    if cols.size == 0:
+        return None
+    rows = numpy.flatnonzero(mask.any(axis=0))
+    left, right = int(cols[0]), int(cols[-1])
+    top, bottom = int(rows[0]), int(rows[-1])
+    return pygame.Rect(rect.x + left, rect.y + top,
+                       right - left + 1, bottom - top + 1)
+
+
+def reading_order(rects):
+    """Sorts rects into rows top to bottom, each row left to right.
+
+    A rect joins the current row when its vertical centre falls inside
+    the span of the rects already in that row.
+    """
+    rows = []
+    for rect in sorted(rects, key=lambda r: r.y):
+        if rows and rect.centery < rows[-1][0]:
+            bottom, row = rows[-1]
+            row.append(rect)
+            rows[-1] = (max(bottom, rect.bottom), row)
+        else:
+            rows.append((rect.bottom, [rect]))
+    ordered = []
+    for bottom, row in rows:
+        ordered.extend(sorted(row, key=lambda r: r.x))
+    return ordered
+
+
+def detect_sprites(image, rect=None, background=None):
+    """Finds every sprite on the sheet in one pass.
+
+    Connected regions of foreground pixels inside rect are labelled and
+    returned as trimmed rects, in image coords and reading order.
+    """
+    if rect is None:
+        rect = image.get_rect()
+    rect = pygame.Rect(rect).clip(image.get_rect())
+    if rect.w == 0 or rect.h == 0:
+        return []
+    # Copy the foreground into an 8 bit colour keyed surface so that
+    # pygame's mask module can label the components in C.
+    labels = pygame.Surface(rect.size, 0, 8)
+    pygame.surfarray.pixels2d(labels)[...] = foreground_mask(image, rect,
+                                                             background)
+    labels.set_colorkey(0)
+    mask = pygame.mask.from_surface(labels)
+    rects = [r.move(rect.x, rect.y) for r in mask.get_bounding_rects()]
+    return reading_order(rects)